@@ -0,0 +1 @@
+"""Shared life-table code used by the Streamlit pages."""
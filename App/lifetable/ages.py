@@ -0,0 +1,100 @@
+"""
+Age grids of the life tables.
+
+An AgeSchema holds everything the engine and the loaders need to know about the age
+groups: their labels in order, the width of each interval (0 for the open-ended last
+group), the default nax values and the position of each label. The schema used by
+default is chosen with LIFETABLE_AGE_SCHEMA, either the name of a built-in schema
+('gbd', '85+' or 'single-year') or the path of a JSON file with the keys name,
+labels, widths and nax.
+"""
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+class AgeSchema:
+    """
+    Ordered age groups of a life table.
+
+    name: Short name identifying the schema.
+    labels: Age group labels as they appear in the data, youngest first.
+    widths: Years in each interval; the last, open-ended interval has width 0.
+    nax: Default fraction of each interval lived by those dying in it.
+    """
+
+    def __init__(self, name, labels, widths, nax):
+        if not len(labels) == len(widths) == len(nax):
+            raise ValueError("An age schema needs one width and one nax value per label")
+        if len(set(labels)) != len(labels):
+            raise ValueError("Age group labels must be unique")
+        self.name = name
+        self.labels = list(labels)
+        self.widths = np.array(widths, dtype=float)
+        self.nax = np.array(nax, dtype=float)
+        self.position = {label: position for position, label in enumerate(self.labels)}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __repr__(self):
+        return f"AgeSchema({self.name!r}, {len(self)} age groups)"
+
+    def positions(self, labels):
+        """
+        Return the position of each label as a float array, NaN for labels outside the schema.
+
+        Categorical columns are resolved through their categories, so the lookup runs
+        once per distinct label rather than once per row.
+        """
+        labels = labels if isinstance(labels, pd.Series) else pd.Series(labels)
+        if isinstance(labels.dtype, pd.CategoricalDtype):
+            lookup = np.array([self.position.get(label, np.nan) for label in labels.cat.categories] + [np.nan])
+            # Missing values have code -1, which picks the trailing NaN
+            return lookup[labels.cat.codes.to_numpy()]
+        return labels.map(self.position).to_numpy(dtype=float)
+
+    @classmethod
+    def load(cls, path):
+        """Read a schema from a JSON file with the keys name, labels, widths and nax"""
+        with open(path) as file:
+            spec = json.load(file)
+        return cls(spec.get('name', os.path.splitext(os.path.basename(path))[0]), spec['labels'], spec['widths'], spec['nax'])
+
+
+def single_year_schema(open_age=100):
+    """Single years of age from <1 up to an open-ended open_age+ group"""
+    labels = ['<1 year', '1 year'] + [f'{age} years' for age in range(2, open_age)] + [f'{open_age}+ years']
+    return AgeSchema('single-year', labels, [1] * open_age + [0], [0.1] + [0.5] * open_age)
+
+
+# The GBD grid of the PopulationData table: <1, 12-23 months, 2-4, then five-year groups up to 95+
+GBD_SCHEMA = AgeSchema(
+    'gbd',
+    ['<1 year', '12-23 months', '2-4 years', '5-9 years', '10-14 years', '15-19 years',
+     '20-24 years', '25-29 years', '30-34 years', '35-39 years', '40-44 years',
+     '45-49 years', '50-54 years', '55-59 years', '60-64 years', '65-69 years',
+     '70-74 years', '75-79 years', '80-84 years', '85-89 years', '90-94 years', '95+ years'],
+    [1, 1, 3] + [5] * 18 + [0],
+    [0.1, 0.3, 0.4] + [0.5] * 19,
+)
+
+# The same grid closed at 85+, as used by many national statistics offices
+OPEN_85_SCHEMA = AgeSchema('85+', GBD_SCHEMA.labels[:19] + ['85+ years'], [1, 1, 3] + [5] * 16 + [0], [0.1, 0.3, 0.4] + [0.5] * 17)
+
+SCHEMAS = {schema.name: schema for schema in [GBD_SCHEMA, OPEN_85_SCHEMA, single_year_schema()]}
+
+
+def get_schema(name):
+    """Return a built-in schema by name, or load one from a JSON file path"""
+    if isinstance(name, AgeSchema):
+        return name
+    if name in SCHEMAS:
+        return SCHEMAS[name]
+    if os.path.exists(name):
+        return AgeSchema.load(name)
+    raise ValueError(f"Unknown age schema {name!r}, expected one of {sorted(SCHEMAS)} or a JSON file")
+
+
+DEFAULT_SCHEMA = get_schema(os.getenv('LIFETABLE_AGE_SCHEMA', 'gbd'))
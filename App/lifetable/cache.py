@@ -0,0 +1,112 @@
+"""
+Process-wide memo of computed life tables.
+
+Streamlit imports this module once per server process, so every page and session
+shares LIFE_TABLE_CACHE: a table computed on one page is reused on the others and
+on every rerun. Entries are keyed by the (location, sex, year) group together with
+a hash of its age schema and its deaths and population vectors, and evicted least recently used first.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from lifetable.ages import DEFAULT_SCHEMA
+from lifetable.engine import calculate_life_tables
+from lifetable.metrics import incr
+
+CACHE_SIZE = int(os.getenv('LIFETABLE_RESULT_CACHE_SIZE', 4096))  # life tables
+
+
+class LifeTableCache:
+    """Bounded LRU cache of single life tables with hit/miss counters"""
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(group, deaths, population, schema=DEFAULT_SCHEMA):
+        """Key of one life table: its group plus a digest of the age schema and the input vectors"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(schema.name.encode())
+        digest.update(schema.nax.tobytes())
+        digest.update(np.ascontiguousarray(deaths, dtype=float).tobytes())
+        digest.update(np.ascontiguousarray(population, dtype=float).tobytes())
+        return tuple(group), digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached table for key, or None"""
+        with self._lock:
+            table = self._tables.get(key)
+            if table is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._tables.move_to_end(key)
+            return table
+
+    def put(self, key, table):
+        """Store a table, evicting the least recently used ones beyond maxsize"""
+        with self._lock:
+            self._tables[key] = table
+            self._tables.move_to_end(key)
+            while len(self._tables) > self.maxsize:
+                self._tables.popitem(last=False)
+
+    def invalidate(self, groups=None):
+        """Drop the tables of the given (location, sex, year) groups, or every table when groups is None"""
+        with self._lock:
+            if groups is None:
+                self._tables.clear()
+                return
+            groups = {tuple(group) for group in groups}
+            for key in [key for key in self._tables if key[0] in groups]:
+                del self._tables[key]
+
+    def stats(self):
+        """Return the hit/miss counters and current size"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._tables), 'maxsize': self.maxsize}
+
+
+LIFE_TABLE_CACHE = LifeTableCache()
+
+# Arriaga contributions of pairs of life tables, keyed like the tables by the pair and its input vectors
+CONTRIBUTION_CACHE = LifeTableCache()
+
+
+def cached_life_tables(groups, deaths, population, cache=LIFE_TABLE_CACHE, schema=DEFAULT_SCHEMA):
+    """
+    Calculate life tables like calculate_life_tables, reusing cached results.
+
+    groups: List of (location, sex, year) keys, one per row of deaths and population.
+    deaths, population: Arrays of shape (groups, age groups).
+
+    Only the groups missing from the cache are calculated, in a single batched call.
+    Batches larger than the cache are calculated directly.
+    """
+    deaths = np.atleast_2d(np.asarray(deaths, dtype=float))
+    population = np.atleast_2d(np.asarray(population, dtype=float))
+
+    # A batch bigger than the cache would only evict itself, so skip the bookkeeping
+    if len(groups) > cache.maxsize:
+        return calculate_life_tables(deaths, population, schema)
+
+    keys = [cache.make_key(group, deaths[row], population[row], schema) for row, group in enumerate(groups)]
+    found = [cache.get(key) for key in keys]
+
+    missing = [row for row, table in enumerate(found) if table is None]
+    incr('cache.hits', len(found) - len(missing))
+    incr('cache.misses', len(missing))
+    if missing:
+        tables = calculate_life_tables(deaths[missing], population[missing], schema)
+        for position, row in enumerate(missing):
+            # Copy the row so the cache does not keep the whole batch alive
+            found[row] = {column: values[position].copy() for column, values in tables.items()}
+            cache.put(keys[row], found[row])
+
+    return {column: np.stack([table[column] for table in found]) for column in found[0]} if found else {}
@@ -0,0 +1,214 @@
+"""
+Headless command-line entry point.
+
+Usage (from the App directory):
+    python -m lifetable batch [--location NAME ...] [--sex NAME ...] [--year 2000-2021 ...]
+                              [--output life_tables.parquet] [--summary e0.parquet]
+                              [--workers N] [--chunk-size N]
+    python -m lifetable cause-deleted [--location NAME ...] [--sex NAME ...] [--year 2000-2021 ...]
+                                      [--output gains.parquet]
+    python -m lifetable sync [TABLE ...]
+    python -m lifetable ingest FILE [FILE ...] [--table PopulationData] [--chunk-size N]
+                               [--sheet NAME] [--rejections rejected.csv]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from lifetable.data import LIFE_TABLE_COLUMNS, RISK_FACTOR_COLUMNS
+from lifetable.engine import calculate_life_tables
+from lifetable.export import long_format_chunk
+from lifetable.index import GroupIndex
+from lifetable.query import query_table
+
+
+def parse_years(values):
+    """Expand --year arguments such as '2019' or '2000-2021' into a sorted list of years"""
+    years = set()
+    for value in values:
+        start, _, end = value.partition('-')
+        years.update(range(int(start), int(end or start) + 1))
+    return sorted(years)
+
+
+def _calculate_chunk(arrays):
+    """Worker: calculate the life tables of one chunk of groups"""
+    deaths, population = arrays
+    return calculate_life_tables(deaths, population)
+
+
+def calculate_chunks(deaths, population, chunk_size, workers):
+    """Yield the life tables of consecutive chunks of groups, in order, fanning the chunks out over a process pool"""
+    chunks = [(deaths[start:start + chunk_size], population[start:start + chunk_size])
+              for start in range(0, len(deaths), chunk_size)]
+    if workers <= 1 or len(chunks) <= 1:
+        yield from map(_calculate_chunk, chunks)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(_calculate_chunk, chunks)
+
+
+class _ColumnarWriter:
+    """Append DataFrame chunks to a Parquet file, or to a CSV file when the path ends in .csv"""
+
+    def __init__(self, path):
+        self.path = path
+        self.writer = None
+
+    def write(self, chunk):
+        if self.path.endswith('.csv'):
+            chunk.to_csv(self.path, mode='w' if self.writer is None else 'a', header=self.writer is None, index=False)
+            self.writer = True
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer not in (None, True):
+            self.writer.close()
+
+
+def selection_filters(args):
+    """Turn the --location, --sex and --year arguments into query filters"""
+    filters = {}
+    if args.location:
+        filters['location_name'] = args.location
+    if args.sex:
+        filters['sex_name'] = args.sex
+    if args.year:
+        filters['year'] = parse_years(args.year)
+    return filters
+
+
+def add_selection_arguments(parser):
+    parser.add_argument('--location', action='append', help="Only this location (repeatable)")
+    parser.add_argument('--sex', action='append', help="Only this sex (repeatable)")
+    parser.add_argument('--year', action='append', help="Only this year or range of years such as 2000-2021 (repeatable)")
+
+
+def run_batch(args):
+    """Calculate the life tables of every group matching the filters and report the throughput"""
+    filters = selection_filters(args)
+
+    started = time.perf_counter()
+    index = GroupIndex(query_table('PopulationData', LIFE_TABLE_COLUMNS, filters))
+    loaded = time.perf_counter()
+    print(f"Loaded {len(index.frame)} rows, {len(index)} (location, sex, year) groups in {loaded - started:.2f}s", file=sys.stderr)
+
+    deaths = index.stack('total_deaths')
+    population = index.stack('population')
+    tables_writer = _ColumnarWriter(args.output) if args.output else None
+    summary = []
+
+    try:
+        start = 0
+        for tables in calculate_chunks(deaths, population, args.chunk_size, args.workers):
+            groups = index.keys[start:start + len(tables['ex'])]
+            start += len(groups)
+            if tables_writer is not None:
+                tables_writer.write(long_format_chunk(groups, tables))
+            summary.append(pd.DataFrame(groups, columns=['location_name', 'sex_name', 'year']).assign(e0=tables['ex'][:, 0]))
+    finally:
+        if tables_writer is not None:
+            tables_writer.close()
+
+    elapsed = time.perf_counter() - loaded
+    rate = len(index) / elapsed if elapsed > 0 else float('inf')
+    print(f"Computed {len(index)} life tables in {elapsed:.2f}s ({rate:,.0f} tables/s) with {args.workers} worker(s)", file=sys.stderr)
+
+    summary = pd.concat(summary, ignore_index=True) if summary else pd.DataFrame(columns=['location_name', 'sex_name', 'year', 'e0'])
+    if args.summary:
+        summary_writer = _ColumnarWriter(args.summary)
+        summary_writer.write(summary)
+        summary_writer.close()
+    elif not args.output:
+        summary.to_csv(sys.stdout, index=False)
+
+
+def run_cause_deleted(args):
+    """Calculate the e0 gain from deleting each risk factor, singly and combined, for every group matching the filters"""
+    from lifetable.cause_deleted import cause_deleted_gains
+
+    started = time.perf_counter()
+    index = GroupIndex(query_table('PopulationData', LIFE_TABLE_COLUMNS + RISK_FACTOR_COLUMNS, selection_filters(args)))
+    loaded = time.perf_counter()
+    gains = cause_deleted_gains(index)
+    elapsed = time.perf_counter() - loaded
+    print(f"Loaded {len(index)} groups in {loaded - started:.2f}s, computed {len(gains)} cause-deleted life tables "
+          f"in {elapsed:.2f}s", file=sys.stderr)
+
+    if args.output:
+        writer = _ColumnarWriter(args.output)
+        writer.write(gains)
+        writer.close()
+    else:
+        gains.to_csv(sys.stdout, index=False)
+
+
+def run_sync(args):
+    from lifetable.sync import main as sync_main
+
+    sync_main(args.tables)
+
+
+def run_ingest(args):
+    """Stream extracts into the local store, showing the throughput and the rows rejected per group"""
+    from lifetable.ingest import ingest_file
+
+    def progress(report):
+        print(f"\r{report.rows_read:,} rows read, {report.rows_per_second:,.0f} rows/s", end='', file=sys.stderr)
+
+    rejections = []
+    for path in args.files:
+        report = ingest_file(path, args.table, chunk_size=args.chunk_size, sheet=args.sheet, progress=progress)
+        print(f"\r{path}: {report.summary()}", file=sys.stderr)
+        rejected = report.rejections()
+        if not rejected.empty:
+            rejections.append(rejected.assign(file=path))
+
+    if rejections:
+        rejections = pd.concat(rejections, ignore_index=True)
+        if args.rejections:
+            rejections.to_csv(args.rejections, index=False)
+        else:
+            rejections.to_csv(sys.stderr, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m lifetable', description="Life-table batch jobs without the Streamlit app.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    batch = commands.add_parser('batch', help="Calculate life tables and e0 for every (location, sex, year) group")
+    add_selection_arguments(batch)
+    batch.add_argument('--output', help="Write the full life tables in long format to this .parquet or .csv file")
+    batch.add_argument('--summary', help="Write e0 per group to this .parquet or .csv file (default: CSV on stdout when --output is not given)")
+    batch.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Number of worker processes (default: CPU count)")
+    batch.add_argument('--chunk-size', type=int, default=2000, help="Groups per worker task (default: 2000)")
+    batch.set_defaults(handler=run_batch)
+
+    cause_deleted = commands.add_parser('cause-deleted', help="e0 gain from deleting tobacco, alcohol and drug deaths per group")
+    add_selection_arguments(cause_deleted)
+    cause_deleted.add_argument('--output', help="Write the gains to this .parquet or .csv file (default: CSV on stdout)")
+    cause_deleted.set_defaults(handler=run_cause_deleted)
+
+    sync = commands.add_parser('sync', help="Fetch rows added or changed in Supabase into the local cache")
+    sync.add_argument('tables', nargs='*', default=['PopulationData'])
+    sync.set_defaults(handler=run_sync)
+
+    ingest = commands.add_parser('ingest', help="Validate CSV or Excel extracts and upsert them into the local store")
+    ingest.add_argument('files', nargs='+', help="CSV (optionally compressed) or .xlsx files")
+    ingest.add_argument('--table', default='PopulationData', help="Table to upsert into (default: PopulationData)")
+    ingest.add_argument('--chunk-size', type=int, default=100000, help="Rows read at a time (default: 100000)")
+    ingest.add_argument('--sheet', help="Worksheet of Excel files (default: the active sheet)")
+    ingest.add_argument('--rejections', help="Write the rejected rows per group and reason to this CSV file (default: stderr)")
+    ingest.set_defaults(handler=run_ingest)
+
+    args = parser.parse_args(argv)
+    args.handler(args)
@@ -0,0 +1,255 @@
+"""Access to the Supabase tables behind the app."""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import numpy as np
+import pandas as pd
+from lifetable.metrics import incr, timed
+
+load_dotenv()
+
+# Column used to give paginated requests a stable row order
+ORDER_COLUMN = os.getenv('LIFETABLE_ORDER_COLUMN', 'id')
+
+BATCH_SIZE = 1000  # Supabase returns at most 1000 rows per request by default
+MAX_WORKERS = 8
+
+# Columns of PopulationData needed to build life tables and risk-factor proportions
+LIFE_TABLE_COLUMNS = ['year', 'location_name', 'sex_name', 'age_name', 'total_deaths', 'population']
+RISK_FACTOR_COLUMNS = ['tobacco_deaths', 'alc_deaths', 'drug_deaths']
+
+# String dimensions with few distinct values, stored as categorical codes
+CATEGORY_COLUMNS = ['location_name', 'sex_name', 'age_name']
+
+_client = None
+_client_lock = threading.Lock()
+
+# Cleared once Supabase rejects an aggregate function, so later calls skip the request
+_aggregates_allowed = True
+
+
+class AggregatesUnavailable(Exception):
+    """Raised when the Supabase project does not allow PostgREST aggregate functions"""
+
+
+def _client_options():
+    """Client options sharing one keep-alive connection pool sized for MAX_WORKERS concurrent requests"""
+    import httpx
+    from supabase import ClientOptions
+
+    try:
+        from postgrest.constants import DEFAULT_POSTGREST_CLIENT_TIMEOUT as timeout
+    except ImportError:
+        timeout = 120
+
+    limits = httpx.Limits(max_connections=MAX_WORKERS, max_keepalive_connections=MAX_WORKERS)
+    try:
+        # postgrest uses a supplied client as-is, so keep its default timeout and redirect handling
+        return ClientOptions(httpx_client=httpx.Client(limits=limits, timeout=httpx.Timeout(timeout), follow_redirects=True))
+    except TypeError:
+        # Older supabase releases manage their own HTTP client
+        return None
+
+
+def get_client():
+    """
+    Return the Supabase client, creating it on first use.
+
+    One client is shared by every page, session and thread of the server process, so
+    requests reuse its pooled keep-alive connections instead of opening new ones.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            # Another thread may have created the client while we waited for the lock
+            if _client is None:
+                from supabase import create_client
+
+                # Supabase credentials
+                url = os.getenv("PROJECT_URL")
+                key = os.getenv("SECRET_PROJECT_API_KEY")
+                options = _client_options()
+                _client = create_client(url, key, options) if options is not None else create_client(url, key)
+    return _client
+
+
+def apply_filters(query, filters=None, newer_than=None):
+    """
+    Add server-side filters to a Supabase query.
+
+    filters: Dict mapping column names to a single value (an eq filter) or to a
+    list of accepted values (an in_ filter).
+    newer_than: Optional (column, value) pair keeping only rows where column > value.
+    """
+    for column, value in (filters or {}).items():
+        if isinstance(value, (list, tuple, set)):
+            query = query.in_(column, list(value))
+        else:
+            query = query.eq(column, value)
+    if newer_than is not None:
+        query = query.gt(*newer_than)
+    return query
+
+
+def count_rows(table, filters=None, newer_than=None):
+    """Return the exact number of matching rows in a Supabase table without downloading them"""
+    incr('supabase.requests')
+    query = get_client().table(table).select('*', count='exact', head=True)
+    return apply_filters(query, filters, newer_than).execute().count
+
+
+def plan_ranges(total_rows, batch_size=BATCH_SIZE):
+    """Split total_rows into inclusive (start, end) row ranges of at most batch_size rows"""
+    return [(start, min(start + batch_size, total_rows) - 1) for start in range(0, total_rows, batch_size)]
+
+
+def compact_column(name, values):
+    """
+    Build one column with the smallest dtype that holds its values exactly.
+
+    String dimensions in CATEGORY_COLUMNS become categoricals, integers are downcast
+    to the smallest integer type, and floats become float32 only when no value changes.
+    """
+    if name in CATEGORY_COLUMNS:
+        return pd.Categorical(values)
+    column = pd.Series(values)
+    if pd.api.types.is_bool_dtype(column):
+        return column
+    if pd.api.types.is_integer_dtype(column):
+        return pd.to_numeric(column, downcast='integer')
+    if pd.api.types.is_float_dtype(column):
+        small = column.astype(np.float32)
+        if np.array_equal(small.to_numpy(dtype=float), column.to_numpy(dtype=float), equal_nan=True):
+            return small
+    return column
+
+
+def compact_frame(df):
+    """Return df with every column converted to its compact dtype, see compact_column"""
+    return pd.DataFrame({column: compact_column(column, df[column]) for column in df.columns}, index=df.index)
+
+
+@timed('frame.build')
+def frame_from_pages(pages, columns=None):
+    """
+    Build a compact DataFrame column by column from pages of JSON rows.
+
+    pages: Lists of row dicts as returned by the Supabase API.
+    columns: Columns to build; the keys of the first row are used when None.
+    """
+    if columns is None:
+        first = next((page[0] for page in pages if page), None)
+        columns = list(first) if first is not None else []
+    return pd.DataFrame({column: compact_column(column, [row[column] for page in pages for row in page])
+                         for column in columns}, columns=columns)
+
+
+@timed('supabase.fetch')
+def fetch_table(table, columns=None, filters=None, newer_than=None, batch_size=BATCH_SIZE, max_workers=MAX_WORKERS):
+    """
+    Fetch a Supabase table with concurrent paginated requests.
+
+    The row count is requested first so every page range can be planned up front and
+    downloaded through a bounded thread pool; pages are reassembled in row order, one
+    compact column at a time (see compact_column).
+
+    table: Name of the Supabase table (e.g. 'PopulationData').
+    columns: Optional list of columns to request; all columns are requested when None.
+    filters: Optional dict of column filters applied on the server, see apply_filters.
+    newer_than: Optional (column, value) pair keeping only rows where column > value.
+    batch_size: Number of rows per request.
+    max_workers: Maximum number of requests in flight at once.
+    """
+    supabase = get_client()
+    select = ','.join(columns) if columns else '*'
+
+    def fetch_page(row_range):
+        query = apply_filters(supabase.table(table).select(select), filters, newer_than)
+        if ORDER_COLUMN:
+            query = query.order(ORDER_COLUMN)
+        incr('supabase.requests')
+        return query.range(*row_range).execute().data
+
+    ranges = plan_ranges(count_rows(table, filters, newer_than), batch_size)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(ranges)))) as pool:
+        # map yields the pages in the order of the planned ranges
+        pages = list(pool.map(fetch_page, ranges))
+    incr('supabase.rows', sum(len(page) for page in pages))
+
+    return frame_from_pages(pages, columns)
+
+
+def fetch_range(table, columns=None, filters=None, offset=0, limit=BATCH_SIZE):
+    """
+    Fetch one window of rows of a Supabase table, in ORDER_COLUMN order.
+
+    offset: Number of matching rows to skip.
+    limit: Maximum number of rows to return (at most BATCH_SIZE per request).
+    """
+    if limit <= 0:
+        return frame_from_pages([], columns)
+    incr('supabase.requests')
+    query = apply_filters(get_client().table(table).select(','.join(columns) if columns else '*'), filters)
+    if ORDER_COLUMN:
+        query = query.order(ORDER_COLUMN)
+    return frame_from_pages([query.range(offset, offset + limit - 1).execute().data], columns)
+
+
+def _grouped_pages(table, select, by, filters=None, batch_size=BATCH_SIZE):
+    """
+    Fetch the pages of a select using PostgREST aggregate functions, grouped by the columns of by.
+
+    Raises AggregatesUnavailable when the project does not allow aggregate functions,
+    which is the default on Supabase.
+    """
+    global _aggregates_allowed
+    from postgrest.exceptions import APIError
+
+    if not _aggregates_allowed:
+        raise AggregatesUnavailable(f"Aggregate functions are not enabled for {table}")
+    pages = []
+    while True:
+        query = apply_filters(get_client().table(table).select(select), filters)
+        for column in by:
+            query = query.order(column)
+        start = len(pages) * batch_size
+        incr('supabase.requests')
+        try:
+            pages.append(query.range(start, start + batch_size - 1).execute().data)
+        except APIError as error:
+            # PGRST123: "Use of aggregate functions is not allowed"
+            if getattr(error, 'code', None) != 'PGRST123':
+                raise
+            _aggregates_allowed = False
+            raise AggregatesUnavailable(f"Aggregate functions are not enabled for {table}") from error
+        if len(pages[-1]) < batch_size:
+            return pages
+
+
+def aggregate_rows(table, by, sums, filters=None, batch_size=BATCH_SIZE):
+    """
+    Sum columns of a Supabase table by group on the server.
+
+    Uses PostgREST aggregate functions (these must be enabled on the project), so only
+    one row per group is downloaded; raises AggregatesUnavailable otherwise.
+
+    by: Columns to group by (e.g. ['location_name', 'year']).
+    sums: Columns to sum within each group.
+    """
+    select = ','.join(list(by) + [f'{column}:{column}.sum()' for column in sums])
+    return frame_from_pages(_grouped_pages(table, select, by, filters, batch_size), list(by) + list(sums))
+
+
+def distinct_rows(table, column, batch_size=BATCH_SIZE):
+    """
+    Return the sorted distinct values of one column of a Supabase table.
+
+    The rows are grouped on the server when aggregate functions are enabled, so one row
+    per value is downloaded; otherwise only that one column is downloaded.
+    """
+    try:
+        values = frame_from_pages(_grouped_pages(table, f'{column},rows:count()', [column], batch_size=batch_size), [column])
+    except AggregatesUnavailable:
+        values = fetch_table(table, [column], batch_size=batch_size)
+    return sorted(values[column].dropna().unique().tolist())
@@ -0,0 +1,285 @@
+"""
+Arriaga decomposition of life-expectancy differences by age group.
+
+The contributions are computed on stacked life-table arrays, so one call decomposes
+any number of pairs of life tables at once.
+"""
+import numpy as np
+import pandas as pd
+from lifetable.cache import CONTRIBUTION_CACHE, cached_life_tables
+from lifetable.ages import DEFAULT_SCHEMA
+from lifetable.engine import COLUMN_LABELS
+from lifetable.metrics import incr, timed
+
+# Risk factors with their PopulationData death columns
+RISK_FACTORS = {'tobacco': 'tobacco_deaths', 'alcohol': 'alc_deaths', 'drug': 'drug_deaths'}
+
+
+@timed('decomposition.arriaga')
+def arriaga_contributions(tables_1, tables_2):
+    """
+    Calculate the contribution of each age group to the life expectancy difference between pairs of life tables.
+
+    tables_1: Life tables of the first (earlier) member of each pair, as returned by calculate_life_tables.
+    tables_2: Life tables of the second (later) member of each pair, with the same shape.
+
+    Returns:
+    An array of shape (pairs, age groups); each row sums to e0 of table 2 minus e0 of table 1.
+    """
+    lx_1, nLx_1, Tx_1 = tables_1['lx'], tables_1['nLx'], tables_1['Tx']
+    lx_2, nLx_2, Tx_2 = tables_2['lx'], tables_2['nLx'], tables_2['Tx']
+    radix = lx_1[:, :1]
+
+    contributions = np.empty_like(lx_1)
+
+    # Direct effect of the change in years lived within the age group
+    first_term = (lx_1[:, :-1] / radix) * (nLx_2[:, :-1] / lx_2[:, :-1] - nLx_1[:, :-1] / lx_1[:, :-1])
+    # Indirect effect of the extra survivors reaching the next age group
+    second_term = (Tx_2[:, 1:] / radix) * (lx_1[:, :-1] / lx_2[:, :-1] - lx_1[:, 1:] / lx_2[:, 1:])
+    contributions[:, :-1] = first_term + second_term
+
+    # Last age group (open-ended)
+    contributions[:, -1] = (lx_1[:, -1] / radix[:, 0]) * (Tx_2[:, -1] / lx_2[:, -1] - Tx_1[:, -1] / lx_1[:, -1])
+
+    return contributions
+
+
+def calculate_life_expectancy_contribution(life_table_1, life_table_2):
+    """Calculate the contribution of each age group to life expectancy difference between two years."""
+    # Ensure that the dataframes are aligned on age groups
+    if not (life_table_1['Age'].equals(life_table_2['Age'])):
+        raise ValueError("Age groups in the two life tables must match")
+
+    columns = ['lx', 'nLx', 'Tx']
+    contributions = arriaga_contributions(
+        {column: life_table_1[COLUMN_LABELS[column]].to_numpy(dtype=float)[np.newaxis] for column in columns},
+        {column: life_table_2[COLUMN_LABELS[column]].to_numpy(dtype=float)[np.newaxis] for column in columns},
+    )[0]
+
+    # Create a DataFrame for the contributions, with a row for their sum
+    return pd.DataFrame({
+        'Age': list(life_table_1['Age']) + ['Life expectancy difference'],
+        'Contribution to LE difference (years)': list(contributions) + [contributions.sum()],
+    })
+
+
+def risk_factor_contributions(delta, mortality_rate_1, mortality_rate_2, proportions_1, proportions_2):
+    """
+    Split age-group contributions between risk factors for any number of pairs at once.
+
+    delta: Array of shape (..., age groups) with the contribution of each age group.
+    mortality_rate_1, mortality_rate_2: nmx arrays of the same shape for both members of each pair.
+    proportions_1, proportions_2: Arrays of shape (..., age groups, risk factors) with the
+    share of deaths attributable to each risk factor.
+
+    The contribution of a risk factor is delta weighted by its share of the change in
+    mortality. Where the two mortality rates are equal that share is undefined (and the
+    age group's contribution is zero anyway), so the mean of the two proportions is used.
+
+    Returns:
+    An array of shape (..., age groups, risk factors).
+    """
+    mortality_rate_1 = np.asarray(mortality_rate_1, dtype=float)[..., np.newaxis]
+    mortality_rate_2 = np.asarray(mortality_rate_2, dtype=float)[..., np.newaxis]
+    change = mortality_rate_2 - mortality_rate_1
+    equal = change == 0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = (proportions_2 * mortality_rate_2 - proportions_1 * mortality_rate_1) / np.where(equal, 1, change)
+    weights = np.where(equal, (proportions_1 + proportions_2) / 2, weights)
+
+    return np.asarray(delta, dtype=float)[..., np.newaxis] * weights
+
+
+def stack_risk_factor_proportions(index, groups):
+    """Return a (groups, age groups, risk factors) array of risk-factor deaths over total deaths, 0 where there are no deaths"""
+    total_deaths = index.stack('total_deaths', groups)
+    risk_deaths = np.stack([index.stack(column, groups) for column in RISK_FACTORS.values()], axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        proportions = risk_deaths / total_deaths[..., np.newaxis]
+    return np.where(total_deaths[..., np.newaxis] > 0, proportions, 0.0)
+
+
+def calculate_risk_factor_proportions(df, year, schema=DEFAULT_SCHEMA):
+    """
+    Calculate the proportions of deaths attributable to each risk factor (e.g., tobacco, alcohol, drugs)
+    based on the total deaths for each age group and return a DataFrame that includes the age group.
+
+    df: DataFrame containing the columns 'total_deaths', 'tobacco_deaths', 'alc_deaths', 'drug_deaths', 'age_name'.
+    year: The year of the data being processed (e.g., 2018, 2021).
+    schema: AgeSchema giving the age groups and their order.
+
+    Returns:
+    A DataFrame with the age group and the calculated proportions for each risk factor for the given year,
+    one row per age group of the schema.
+    """
+    # Check if necessary columns exist
+    required_columns = ['total_deaths', 'age_name'] + list(RISK_FACTORS.values())
+    if not all(col in df.columns for col in required_columns):
+        raise ValueError(f"DataFrame must contain the following columns: {required_columns}")
+
+    # Align the rows on the age order rather than relying on the order of df
+    df_filtered = df[df['year'] == year].set_index('age_name').reindex(schema.labels)
+    total_deaths = df_filtered['total_deaths'].to_numpy(dtype=float)
+
+    risk_proportions = pd.DataFrame({'age_name': schema.labels})
+    for risk_factor, column in RISK_FACTORS.items():
+        with np.errstate(divide='ignore', invalid='ignore'):
+            proportion = df_filtered[column].to_numpy(dtype=float) / total_deaths
+        risk_proportions[f'{risk_factor}_proportion'] = np.where(total_deaths > 0, proportion, 0.0)
+
+    return risk_proportions
+
+
+@timed('decomposition.risk_factors')
+def calculate_risk_factor_contributions(delta_x, mortality_rate_1, mortality_rate_2, risk_proportions_1, risk_proportions_2,
+                                        schema=DEFAULT_SCHEMA):
+    """
+    Calculate the contribution of each risk factor to the life expectancy difference in each age group.
+
+    delta_x: Series containing the contribution of each age group to life expectancy difference.
+    mortality_rate_1: Series containing mortality rates for each age group in year 1.
+    mortality_rate_2: Series containing mortality rates for each age group in year 2.
+    risk_proportions_1: DataFrame from calculate_risk_factor_proportions for year 1.
+    risk_proportions_2: DataFrame from calculate_risk_factor_proportions for year 2.
+    schema: AgeSchema of the life tables.
+
+    Returns:
+    A DataFrame with the contribution of each risk factor to life expectancy difference by age group.
+    """
+    # Match both proportion tables to the age order of the life tables
+    columns = [f'{risk_factor}_proportion' for risk_factor in RISK_FACTORS]
+    proportions_1 = risk_proportions_1.set_index('age_name').reindex(schema.labels)[columns].to_numpy(dtype=float)
+    proportions_2 = risk_proportions_2.set_index('age_name').reindex(schema.labels)[columns].to_numpy(dtype=float)
+
+    contributions = risk_factor_contributions(
+        np.asarray(delta_x, dtype=float)[:len(schema)],
+        np.asarray(mortality_rate_1, dtype=float),
+        np.asarray(mortality_rate_2, dtype=float),
+        proportions_1,
+        proportions_2,
+    )
+
+    contribution_df = pd.DataFrame(contributions, columns=[f'{risk_factor}_contribution' for risk_factor in RISK_FACTORS])
+    contribution_df.insert(0, 'Age', schema.labels)
+    return contribution_df
+
+
+def consecutive_year_pairs(groups):
+    """Return (location, sex, earlier year, later year) for every pair of consecutive years available per location and sex"""
+    years = {}
+    for location, sex, year in groups:
+        years.setdefault((location, sex), set()).add(year)
+    return [(location, sex, year_1, year_2)
+            for (location, sex), available in years.items()
+            for year_1, year_2 in zip(sorted(available), sorted(available)[1:])]
+
+
+def reference_year_pairs(groups, reference_year):
+    """Return (location, sex, reference year, year) comparing every other available year with reference_year"""
+    years = {}
+    for location, sex, year in groups:
+        years.setdefault((location, sex), set()).add(year)
+    return [(location, sex, reference_year, year)
+            for (location, sex), available in years.items() if reference_year in available
+            for year in sorted(available) if year != reference_year]
+
+
+def _pair_rows(pairs):
+    """Return the distinct groups of pairs, and the row of each pair's first and second group among them"""
+    groups = list(dict.fromkeys(group for location, sex, year_1, year_2 in pairs
+                                for group in [(location, sex, year_1), (location, sex, year_2)]))
+    rows = {group: row for row, group in enumerate(groups)}
+    rows_1 = [rows[(location, sex, year_1)] for location, sex, year_1, year_2 in pairs]
+    rows_2 = [rows[(location, sex, year_2)] for location, sex, year_1, year_2 in pairs]
+    return groups, rows_1, rows_2
+
+
+def cached_contributions(index, pairs, cache=CONTRIBUTION_CACHE):
+    """
+    Return the Arriaga contributions of pairs of years, reusing cached ones.
+
+    index: GroupIndex holding the population data of every year involved.
+    pairs: List of (location, sex, year_1, year_2); year_1 is the baseline.
+
+    Only the life tables of the pairs missing from the cache are looked up or calculated.
+
+    Returns:
+    An array of shape (pairs, age groups).
+    """
+    groups, rows_1, rows_2 = _pair_rows(pairs)
+    deaths = index.stack('total_deaths', groups)
+    population = index.stack('population', groups)
+
+    # A pair is keyed by both of its life tables' input vectors, so a changed year never hits a stale entry
+    use_cache = len(pairs) <= cache.maxsize
+    keys = [cache.make_key(pair, np.concatenate([deaths[row_1], deaths[row_2]]),
+                           np.concatenate([population[row_1], population[row_2]]), index.schema)
+            for pair, row_1, row_2 in zip(pairs, rows_1, rows_2)] if use_cache else []
+    found = [cache.get(key) for key in keys] if use_cache else [None] * len(pairs)
+
+    missing = [position for position, contributions in enumerate(found) if contributions is None]
+    incr('decomposition.cache_hits', len(pairs) - len(missing))
+    if missing:
+        needed = list(dict.fromkeys(row for position in missing for row in (rows_1[position], rows_2[position])))
+        tables = cached_life_tables([groups[row] for row in needed], deaths[needed], population[needed], schema=index.schema)
+        positions = {row: position for position, row in enumerate(needed)}
+        contributions = arriaga_contributions(
+            {column: values[[positions[rows_1[position]] for position in missing]] for column, values in tables.items()},
+            {column: values[[positions[rows_2[position]] for position in missing]] for column, values in tables.items()},
+        )
+        for position, values in zip(missing, contributions):
+            found[position] = values
+            if use_cache:
+                cache.put(keys[position], values.copy())
+
+    return np.stack(found) if found else np.empty((0, len(index.schema)))
+
+
+@timed('decomposition.pairs')
+def decompose_pairs(index, pairs, risk_factors=False):
+    """
+    Decompose the life expectancy difference of many pairs of years in one call.
+
+    index: GroupIndex holding the population data of every year involved.
+    pairs: List of (location, sex, year_1, year_2); year_1 is the baseline.
+    risk_factors: Also split every contribution between the RISK_FACTORS; the index
+    must then hold their death columns.
+
+    Returns:
+    A tidy DataFrame with one row per pair and age group and the columns location_name,
+    sex_name, year_1, year_2, age_name and contribution, plus one
+    '<risk factor>_contribution' column per risk factor when requested.
+    """
+    columns = ['location_name', 'sex_name', 'year_1', 'year_2', 'age_name', 'contribution']
+    if risk_factors:
+        columns += [f'{risk_factor}_contribution' for risk_factor in RISK_FACTORS]
+    if not pairs:
+        return pd.DataFrame(columns=columns)
+    incr('decomposition.pairs', len(pairs))
+
+    # Each distinct life table is calculated once, however many pairs it appears in
+    contributions = cached_contributions(index, pairs)
+
+    ages = len(index.schema)
+    location, sex, year_1, year_2 = zip(*pairs)
+    decomposition = pd.DataFrame({
+        'location_name': np.repeat(location, ages),
+        'sex_name': np.repeat(sex, ages),
+        'year_1': np.repeat(year_1, ages),
+        'year_2': np.repeat(year_2, ages),
+        'age_name': np.tile(index.schema.labels, len(pairs)),
+        'contribution': contributions.ravel(),
+    })
+
+    if risk_factors:
+        groups, rows_1, rows_2 = _pair_rows(pairs)
+        tables = cached_life_tables(groups, index.stack('total_deaths', groups), index.stack('population', groups), schema=index.schema)
+        proportions = stack_risk_factor_proportions(index, groups)
+        risk_contributions = risk_factor_contributions(
+            contributions, tables['nmx'][rows_1], tables['nmx'][rows_2], proportions[rows_1], proportions[rows_2],
+        )
+        for position, risk_factor in enumerate(RISK_FACTORS):
+            decomposition[f'{risk_factor}_contribution'] = risk_contributions[..., position].ravel()
+
+    return decomposition[columns]
@@ -0,0 +1,86 @@
+"""Vectorised life-table engine shared by every page."""
+import numpy as np
+import pandas as pd
+from lifetable.ages import DEFAULT_SCHEMA
+from lifetable.metrics import incr, timed
+
+RADIX = 100000  # Assuming starting population of 100,000
+
+# Display names of the life-table columns, in the order they appear in a table
+COLUMN_LABELS = {
+    'n': 'Years in Interval (n)',
+    'deaths': 'Deaths (nDx)',
+    'population': 'Reported Population (nNx)',
+    'nmx': 'Mortality Rate (nmx)',
+    'nax': 'Linearity Adjustment (nax)',
+    'nqx': 'Probability of Dying (nqx)',
+    'npx': 'Probability of Surviving (npx)',
+    'lx': 'Individuals Surviving (lx)',
+    'ndx': 'Deaths in Interval (ndx)',
+    'nLx': 'Years Lived in Interval (nLx)',
+    'Tx': 'Cumulative Years Lived (Tx)',
+    'ex': 'Expectancy of Life at Age x (ex)',
+}
+
+
+@timed('engine.life_tables')
+def calculate_life_tables(deaths, population, schema=DEFAULT_SCHEMA):
+    """
+    Calculate life tables for many populations in a single NumPy pass.
+
+    deaths: array-like of shape (populations, age groups) with the deaths in each age group.
+    population: array-like of the same shape with the reported population in each age group.
+    schema: AgeSchema giving the interval widths and nax values of the age groups.
+
+    Returns:
+    A dict of 2-D arrays, one per column of COLUMN_LABELS, each with one row per population.
+    """
+    deaths = np.atleast_2d(np.asarray(deaths, dtype=float))
+    population = np.atleast_2d(np.asarray(population, dtype=float))
+    if deaths.shape != population.shape:
+        raise ValueError("Deaths and population must have the same shape")
+    if deaths.shape[1] != len(schema):
+        raise ValueError(f"Expected {len(schema)} age groups, got {deaths.shape[1]}")
+    incr('engine.tables', len(deaths))
+
+    n = np.broadcast_to(schema.widths, deaths.shape)
+    nax = np.broadcast_to(schema.nax, deaths.shape)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nmx = deaths / population
+        nqx = n * nmx / (1 + (1 - nax) * nmx * n)
+    npx = 1 - nqx
+
+    # Survivors are the running product of the survival probabilities of the earlier age groups
+    lx = np.cumprod(np.concatenate([np.full((len(npx), 1), float(RADIX)), npx[:, :-1]], axis=1), axis=1)
+
+    # Everyone still alive dies in the open-ended last age group
+    ndx = lx * nqx
+    ndx[:, -1] = lx[:, -1]
+
+    nLx = np.empty_like(lx)
+    nLx[:, :-1] = n[:, :-1] * (lx[:, 1:] + nax[:, :-1] * ndx[:, :-1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nLx[:, -1] = lx[:, -1] / nmx[:, -1]
+
+    # Reverse cumulative sum gives the years lived above each age
+    Tx = np.cumsum(nLx[:, ::-1], axis=1)[:, ::-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ex = Tx / lx
+
+    return {
+        'n': n, 'deaths': deaths, 'population': population, 'nmx': nmx, 'nax': nax,
+        'nqx': nqx, 'npx': npx, 'lx': lx, 'ndx': ndx, 'nLx': nLx, 'Tx': Tx, 'ex': ex,
+    }
+
+
+def life_table_frame(tables, row=0, schema=DEFAULT_SCHEMA):
+    """Build the labelled life-table DataFrame for one population of a calculate_life_tables result."""
+    frame = pd.DataFrame({label: tables[column][row] for column, label in COLUMN_LABELS.items()})
+    frame.insert(0, 'Age', schema.labels)
+    return frame
+
+
+def calculate_life_table(deaths, population, schema=DEFAULT_SCHEMA):
+    """Calculate life table from deaths and population data"""
+    return life_table_frame(calculate_life_tables([deaths], [population], schema), schema=schema)
@@ -0,0 +1,128 @@
+"""
+In-memory export of batches of life tables.
+
+Every export is built in a BytesIO per call, so concurrent sessions never share a
+file. Tables arrive as chunks of (groups, tables) straight from the engine and are
+written chunk by chunk, without first building one DataFrame per life table.
+"""
+import csv
+import io
+import math
+import zipfile
+import numpy as np
+import pandas as pd
+from lifetable.cache import cached_life_tables
+from lifetable.ages import DEFAULT_SCHEMA
+from lifetable.engine import COLUMN_LABELS
+from lifetable.metrics import timed
+
+HEADER = ['Age'] + list(COLUMN_LABELS.values())
+GROUP_HEADER = ['location_name', 'sex_name', 'year']
+
+
+def iter_life_table_chunks(index, groups, chunk_size=256):
+    """Yield (groups, tables) for consecutive chunks of groups, calculating each chunk in one pass"""
+    for start in range(0, len(groups), chunk_size):
+        chunk = groups[start:start + chunk_size]
+        yield chunk, cached_life_tables(chunk, index.stack('total_deaths', chunk), index.stack('population', chunk), schema=index.schema)
+
+
+def _cell(value):
+    """Spreadsheet-safe value: NaN and infinities become empty cells"""
+    return value if math.isfinite(value) else None
+
+
+def table_rows(tables, row, schema=DEFAULT_SCHEMA):
+    """Yield the rows of one life table of a calculate_life_tables result, starting with the age label"""
+    columns = [tables[column][row].tolist() for column in COLUMN_LABELS]
+    for age, values in zip(schema.labels, zip(*columns)):
+        yield [age] + [_cell(value) for value in values]
+
+
+def long_format_chunk(groups, tables, schema=DEFAULT_SCHEMA):
+    """Return one chunk of life tables as a long-format DataFrame, one row per group and age group"""
+    ages = len(schema)
+    chunk = pd.DataFrame(np.repeat(np.array(groups, dtype=object), ages, axis=0), columns=GROUP_HEADER)
+    chunk['year'] = chunk['year'].astype('int64')
+    chunk['Age'] = np.tile(schema.labels, len(groups))
+    for column, label in COLUMN_LABELS.items():
+        chunk[label] = tables[column].ravel()
+    return chunk
+
+
+def default_sheet_name(group):
+    """Excel sheet name for a (location, sex, year) group; sheet names are limited to 31 characters"""
+    location, sex, year = group
+    return f"{location[:22]} {sex[:1]} {year}"[:31]
+
+
+@timed('export.xlsx')
+def export_xlsx(chunks, sheet_name=default_sheet_name, schema=DEFAULT_SCHEMA):
+    """Write every life table to its own sheet of an Excel workbook and return the bytes"""
+    from openpyxl import Workbook
+
+    # Write-only workbooks stream rows out instead of keeping every cell object in memory
+    workbook = Workbook(write_only=True)
+    for groups, tables in chunks:
+        for row, group in enumerate(groups):
+            sheet = workbook.create_sheet(sheet_name(group))
+            sheet.append(HEADER)
+            for values in table_rows(tables, row, schema):
+                sheet.append(values)
+
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+@timed('export.csv')
+def export_csv(chunks, schema=DEFAULT_SCHEMA):
+    """Write every life table to a single long-format CSV file and return the bytes"""
+    buffer = io.StringIO()
+    for number, (groups, tables) in enumerate(chunks):
+        long_format_chunk(groups, tables, schema).to_csv(buffer, header=number == 0, index=False)
+    return buffer.getvalue().encode('utf-8')
+
+
+@timed('export.parquet')
+def export_parquet(chunks, schema=DEFAULT_SCHEMA):
+    """Write every life table to a single long-format Parquet file, one row group per chunk, and return the bytes"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    buffer = io.BytesIO()
+    writer = None
+    for groups, tables in chunks:
+        batch = pa.Table.from_pandas(long_format_chunk(groups, tables, schema), preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(buffer, batch.schema)
+        writer.write_table(batch)
+    if writer is None:
+        return b''
+    writer.close()
+    return buffer.getvalue()
+
+
+@timed('export.zip')
+def export_zip(chunks, file_name=None, schema=DEFAULT_SCHEMA):
+    """Write every life table to its own CSV file inside a zip archive and return the bytes"""
+    file_name = file_name or (lambda group: '_'.join(str(value) for value in group).replace(' ', '_') + '.csv')
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for groups, tables in chunks:
+            for row, group in enumerate(groups):
+                text = io.StringIO()
+                writer = csv.writer(text, lineterminator='\n')
+                writer.writerow(HEADER)
+                writer.writerows(table_rows(tables, row, schema))
+                archive.writestr(file_name(group), text.getvalue())
+    return buffer.getvalue()
+
+
+# Export formats offered for download: label -> (export function, file extension, MIME type)
+EXPORT_FORMATS = {
+    'Excel workbook, one sheet per table (.xlsx)': (export_xlsx, 'xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'Single long-format CSV (.csv)': (export_csv, 'csv', 'text/csv'),
+    'Single long-format Parquet (.parquet)': (export_parquet, 'parquet', 'application/vnd.apache.parquet'),
+    'Zip of CSV files, one per table (.zip)': (export_zip, 'zip', 'application/zip'),
+}
@@ -0,0 +1,96 @@
+"""
+Precomputed (location, sex, year) index over a population dataset.
+
+The rows are ordered once by group and age position so each life table's age groups
+sit in one contiguous, correctly ordered block; looking a group up is then a
+dictionary lookup and a slice instead of boolean masks over the whole frame.
+"""
+import numpy as np
+import pandas as pd
+from lifetable.ages import DEFAULT_SCHEMA
+from lifetable.metrics import timed
+
+GROUP_COLUMNS = ['location_name', 'sex_name', 'year']
+
+
+def _sort_key(df, schema):
+    """Return one int64 per row that orders rows by (location, sex, year, age position)"""
+    key = np.zeros(len(df), dtype=np.int64)
+    for column in GROUP_COLUMNS:
+        codes, uniques = pd.factorize(df[column], sort=True)
+        key = key * max(len(uniques), 1) + codes
+    positions = schema.positions(df['age_name'])
+    return key * len(schema) + np.nan_to_num(positions, nan=len(schema) - 1).astype(np.int64), positions
+
+
+@timed('index.sort')
+def sort_groups(df, schema=DEFAULT_SCHEMA):
+    """Order rows by (location, sex, year) and then by age group, skipping the sort when already ordered"""
+    key, _ = _sort_key(df, schema)
+    if len(key) > 1 and np.any(np.diff(key) < 0):
+        df = df.iloc[np.argsort(key, kind='stable')]
+    return df.reset_index(drop=True)
+
+
+class GroupIndex:
+    """
+    Map each (location_name, sex_name, year) key straight to its ordered rows.
+
+    df: DataFrame with at least the group columns and 'age_name'. Rows with an age
+    group outside the schema are dropped.
+    schema: AgeSchema giving the order of the age groups.
+    """
+
+    @timed('index.build')
+    def __init__(self, df, schema=DEFAULT_SCHEMA):
+        self.schema = schema
+        df = sort_groups(df, schema)
+        key, positions = _sort_key(df, schema)
+        known = ~np.isnan(positions)
+        if not known.all():
+            df, key, positions = df[known].reset_index(drop=True), key[known], positions[known]
+
+        self.frame = df
+        self.positions = positions.astype(np.intp)
+
+        # A new group starts wherever the (location, sex, year) part of the sort key changes
+        group_key = key // len(schema)
+        starts = np.flatnonzero(np.r_[True, group_key[1:] != group_key[:-1]]) if len(df) else np.array([], dtype=np.intp)
+        self.starts = starts
+        self.stops = np.r_[starts[1:], len(df)][:len(starts)].astype(np.intp)
+        self.group_ids = np.repeat(np.arange(len(starts)), self.stops - self.starts)
+
+        self.keys = [tuple(row) for row in df[GROUP_COLUMNS].iloc[starts].values.tolist()]
+        self._groups = {group: number for number, group in enumerate(self.keys)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, group):
+        return tuple(group) in self._groups
+
+    def rows(self, location, sex, year):
+        """Return the rows of one group, ordered by age group"""
+        number = self._groups[(location, sex, year)]
+        return self.frame.iloc[self.starts[number]:self.stops[number]]
+
+    def stack(self, column, keys=None):
+        """
+        Return a (groups, age groups) array of one column.
+
+        keys: Optional list of (location, sex, year) keys selecting and ordering the
+        groups; all groups in index order are returned when None. Age groups missing
+        from the data are left as NaN.
+        """
+        values = self.frame[column].to_numpy(dtype=float)
+        if keys is None:
+            rows = np.arange(len(self.frame))
+            groups = self.group_ids
+            out = np.full((len(self.keys), len(self.schema)), np.nan)
+        else:
+            numbers = [self._groups[tuple(group)] for group in keys]
+            rows = np.concatenate([np.arange(self.starts[n], self.stops[n]) for n in numbers]) if numbers else np.array([], dtype=np.intp)
+            groups = np.repeat(np.arange(len(numbers)), [self.stops[n] - self.starts[n] for n in numbers])
+            out = np.full((len(numbers), len(self.schema)), np.nan)
+        out[groups, self.positions[rows]] = values[rows]
+        return out
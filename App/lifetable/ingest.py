@@ -0,0 +1,244 @@
+"""
+Streaming ingestion of mortality and population extracts into the local store.
+
+CSV and Excel extracts are read in chunks of rows, so files of any size load in
+bounded memory. Each chunk is validated row by row (known age group, non-negative
+death counts, positive population), and age labels are mapped onto the age schema.
+Rows are held back until their (location, sex, year) group has every age group, then
+upserted into the local store in batches, so ingesting an extract again replaces its
+groups instead of duplicating them. Rejected rows are counted per group and reason.
+"""
+import re
+import time
+from collections import Counter
+import numpy as np
+import pandas as pd
+from lifetable.ages import DEFAULT_SCHEMA
+from lifetable.data import LIFE_TABLE_COLUMNS, RISK_FACTOR_COLUMNS, compact_frame
+from lifetable.index import GROUP_COLUMNS
+from lifetable.metrics import incr
+
+CHUNK_SIZE = 100000  # rows read at a time
+WRITE_ROWS = 500000  # rows of complete groups buffered before each append to the store
+
+# Alternative column names found in extracts -> PopulationData column
+COLUMN_ALIASES = {
+    'location': 'location_name', 'country': 'location_name',
+    'sex': 'sex_name', 'gender': 'sex_name',
+    'age': 'age_name', 'age_group': 'age_name', 'age_group_name': 'age_name',
+    'deaths': 'total_deaths', 'pop': 'population',
+}
+
+# Age labels that do not follow the schema's own wording, per schema
+AGE_ALIASES = {
+    'gbd': {'0': '<1 year', 'under 1': '<1 year', '1': '12-23 months', '1 year': '12-23 months'},
+}
+
+COUNT_COLUMNS = ['total_deaths'] + RISK_FACTOR_COLUMNS
+
+
+def _normalise_label(label):
+    """Reduce an age label to a canonical spelling, e.g. '95 plus' -> '95+' and '5 to 9 years' -> '5-9'"""
+    text = str(label).strip().lower()
+    text = re.sub(r'\s+to\s+', '-', text)
+    text = re.sub(r'\s*plus\b', '+', text)
+    text = re.sub(r'\s*\b(years?|yrs?)\b', '', text)
+    return re.sub(r'\s+', '', text)
+
+
+def age_label_lookup(schema=DEFAULT_SCHEMA):
+    """Return a dict mapping normalised age labels to the labels of the schema"""
+    lookup = {_normalise_label(label): label for label in schema.labels}
+    for alias, label in AGE_ALIASES.get(schema.name, {}).items():
+        lookup.setdefault(_normalise_label(alias), label)
+    return lookup
+
+
+class IngestReport:
+    """Counts of rows read, written and rejected during one ingestion, with the rejections per group"""
+
+    def __init__(self):
+        self.rows_read = 0
+        self.rows_written = 0
+        self.groups_written = 0
+        self.rejected = {}  # (location, sex, year) -> Counter of reason -> rows
+        self.started = time.perf_counter()
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows_read / self.seconds if self.seconds > 0 else float('inf')
+
+    @property
+    def rows_rejected(self):
+        return sum(sum(reasons.values()) for reasons in self.rejected.values())
+
+    def reject(self, group, reason, rows=1):
+        """Record rows of a group rejected for one reason"""
+        self.rejected.setdefault(group, Counter())[reason] += rows
+
+    def rejections(self):
+        """Return the rejected rows as a DataFrame with one row per group and reason"""
+        records = [(*group, reason, rows) for group, reasons in self.rejected.items() for reason, rows in reasons.items()]
+        return pd.DataFrame(records, columns=GROUP_COLUMNS + ['reason', 'rows'])
+
+    def summary(self):
+        return (f"Read {self.rows_read:,} rows, wrote {self.rows_written:,} rows ({self.groups_written:,} groups), "
+                f"rejected {self.rows_rejected:,} rows in {self.seconds:.1f}s ({self.rows_per_second:,.0f} rows/s)")
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE, sheet=None):
+    """
+    Yield DataFrames of at most chunk_size rows from a CSV or Excel file.
+
+    Excel workbooks are streamed through openpyxl's read-only mode; any other file is
+    read as CSV (compressed CSV such as .csv.gz included).
+    """
+    if not path.lower().endswith(('.xlsx', '.xlsm')):
+        yield from pd.read_csv(path, chunksize=chunk_size)
+        return
+
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = (workbook[sheet] if sheet else workbook.active).iter_rows(values_only=True)
+        header = [str(name) for name in next(rows, [])]
+        buffer = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) == chunk_size:
+                yield pd.DataFrame(buffer, columns=header)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=header)
+    finally:
+        workbook.close()
+
+
+def _standardise_columns(chunk):
+    """Rename extract columns to PopulationData names and keep only the columns the store holds"""
+    chunk = chunk.rename(columns=lambda name: COLUMN_ALIASES.get(str(name).strip().lower(), str(name).strip().lower()))
+    missing = [column for column in LIFE_TABLE_COLUMNS if column not in chunk]
+    if missing:
+        raise ValueError(f"The extract has no {missing} column(s)")
+    return chunk[LIFE_TABLE_COLUMNS + [column for column in RISK_FACTOR_COLUMNS if column in chunk]]
+
+
+def validate_chunk(chunk, lookup, report):
+    """
+    Clean one chunk of an extract and drop the rows that fail validation.
+
+    Age labels are mapped through lookup; rows with a missing key, an unknown age
+    group, a missing or negative death count or a population that is not positive are
+    recorded in report and dropped.
+    """
+    chunk = _standardise_columns(chunk).copy()
+    for column in ['location_name', 'sex_name']:
+        chunk[column] = chunk[column].astype('string').str.strip()
+    chunk['year'] = pd.to_numeric(chunk['year'], errors='coerce')
+    for column in COUNT_COLUMNS + ['population']:
+        if column in chunk:
+            chunk[column] = pd.to_numeric(chunk[column], errors='coerce')
+
+    # Look each distinct label up once
+    labels = chunk['age_name'].astype('string')
+    mapping = {label: lookup.get(_normalise_label(label)) for label in labels.dropna().unique()}
+    chunk['age_name'] = labels.map(mapping)
+
+    counts = [column for column in COUNT_COLUMNS if column in chunk]
+    checks = [
+        ('missing location, sex or year', chunk[['location_name', 'sex_name', 'year']].isna().any(axis=1).to_numpy()),
+        ('unknown age group', chunk['age_name'].isna().to_numpy()),
+        ('missing or negative deaths', (chunk[counts].isna() | (chunk[counts] < 0)).any(axis=1).to_numpy()),
+        ('population missing or not positive', ~(chunk['population'] > 0).fillna(False).to_numpy()),
+    ]
+    reason = np.select([failed for _, failed in checks], [name for name, _ in checks], default='')
+    bad = reason != ''
+    if bad.any():
+        rejected = chunk.loc[bad, GROUP_COLUMNS].astype(object).assign(reason=reason[bad])
+        for (location, sex, year, why), rows in rejected.value_counts(dropna=False, sort=False).items():
+            report.reject((location, sex, year), why, int(rows))
+    chunk = chunk.loc[~bad]
+    chunk['year'] = chunk['year'].astype('int64')
+    return chunk
+
+
+def ingest_file(path, table='PopulationData', schema=DEFAULT_SCHEMA, chunk_size=CHUNK_SIZE, write_rows=WRITE_ROWS,
+                sheet=None, progress=None):
+    """
+    Stream a CSV or Excel extract into the local copy of a table.
+
+    path: CSV (optionally compressed) or .xlsx file with one row per location, sex, year
+    and age group, and at least the columns of LIFE_TABLE_COLUMNS (or their aliases in
+    COLUMN_ALIASES).
+    table: Table of the local store to upsert into; see lifetable.store.append_table.
+    chunk_size: Rows read and validated at a time.
+    write_rows: Rows of complete groups buffered before each append to the store.
+    sheet: Worksheet of an Excel file; the active sheet by default.
+    progress: Optional callable receiving the IngestReport after every chunk.
+
+    Returns:
+    The IngestReport of the run.
+    """
+    from lifetable.store import append_table
+
+    report = IngestReport()
+    lookup = age_label_lookup(schema)
+    ages = len(schema)
+    pending = None  # rows of groups still missing age groups
+    ready = []
+    ready_rows = 0
+    written = set()
+
+    def flush():
+        nonlocal ready, ready_rows
+        if ready:
+            batch = compact_frame(pd.concat(ready, ignore_index=True))
+            append_table(table, batch)
+            report.rows_written += len(batch)
+            incr('ingest.rows_written', len(batch))
+        ready, ready_rows = [], 0
+
+    for chunk in read_chunks(path, chunk_size, sheet):
+        report.rows_read += len(chunk)
+        incr('ingest.rows_read', len(chunk))
+        rows = validate_chunk(chunk, lookup, report)
+        if pending is not None and not pending.empty:
+            rows = pd.concat([pending, rows], ignore_index=True)
+
+        # A repeated age group replaces the earlier row of its group
+        duplicated = rows.duplicated(GROUP_COLUMNS + ['age_name'], keep='last').to_numpy()
+        if duplicated.any():
+            for group, count in rows.loc[duplicated, GROUP_COLUMNS].value_counts(sort=False).items():
+                report.reject(tuple(group), 'duplicate age group', int(count))
+            rows = rows.loc[~duplicated]
+
+        sizes = rows.groupby(GROUP_COLUMNS, sort=False)['age_name'].transform('size').to_numpy()
+        complete = sizes == ages
+        pending = rows.loc[~complete]
+        if complete.any():
+            done = rows.loc[complete]
+            groups = [tuple(group) for group in done[GROUP_COLUMNS].drop_duplicates().values.tolist()]
+            report.groups_written += len(groups)
+            written.update(groups)
+            ready.append(done)
+            ready_rows += len(done)
+            if ready_rows >= write_rows:
+                flush()
+        if progress is not None:
+            progress(report)
+    flush()
+
+    # Whatever is still pending never got all of its age groups
+    if pending is not None and not pending.empty:
+        for group, count in pending.groupby(GROUP_COLUMNS, sort=False).size().items():
+            group = tuple(group)
+            if group in written:
+                report.reject(group, 'rows for a group already loaded', int(count))
+            else:
+                report.reject(group, f'incomplete group ({count} of {ages} age groups)', int(count))
+    return report
@@ -0,0 +1,105 @@
+"""
+Timing spans and counters for the hot paths.
+
+Turn on with LIFETABLE_METRICS=1. Every span and counter is then added to
+process-wide totals shown in the sidebar debug panel and, when LIFETABLE_METRICS_FILE
+is set, appended to that file as one JSON object per line. When turned off, span()
+returns a shared do-nothing context manager, incr() returns immediately and timed()
+leaves the decorated function untouched.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+ENABLED = os.getenv('LIFETABLE_METRICS', '').lower() in ('1', 'true', 'yes', 'on')
+METRICS_FILE = os.getenv('LIFETABLE_METRICS_FILE')
+
+_lock = threading.Lock()
+_spans = {}  # name -> [count, total seconds, max seconds]
+_counters = {}  # name -> total
+_file = None
+_DISABLED = nullcontext()
+
+
+def _emit(record):
+    global _file
+    if METRICS_FILE is None:
+        return
+    # Called with _lock held, so lines from different threads never interleave
+    if _file is None:
+        _file = open(METRICS_FILE, 'a', buffering=1)
+    _file.write(json.dumps(record, default=str) + '\n')
+
+
+@contextmanager
+def _span(name, fields):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        with _lock:
+            totals = _spans.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+            _emit({'ts': time.time(), 'type': 'span', 'name': name, 'seconds': seconds,
+                   'thread': threading.current_thread().name, **fields})
+
+
+def span(name, **fields):
+    """
+    Time the enclosed block as one span of name.
+
+    fields: Extra values (e.g. table=..., rows=...) written with the span to the metrics file.
+    """
+    if not ENABLED:
+        return _DISABLED
+    return _span(name, fields)
+
+
+def timed(name):
+    """Decorator timing every call of a function as a span of name"""
+    def decorate(function):
+        if not ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _span(name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def incr(name, value=1):
+    """Add value to the counter name"""
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+        _emit({'ts': time.time(), 'type': 'counter', 'name': name, 'value': value})
+
+
+def snapshot():
+    """
+    Return the totals recorded so far.
+
+    Returns:
+    A dict with 'spans', mapping each span name to its count, total, mean and max
+    seconds, and 'counters', mapping each counter name to its total.
+    """
+    with _lock:
+        spans = {name: {'count': count, 'total_s': total, 'mean_s': total / count, 'max_s': longest}
+                 for name, (count, total, longest) in _spans.items()}
+        return {'spans': spans, 'counters': dict(_counters)}
+
+
+def reset():
+    """Forget every recorded span and counter"""
+    with _lock:
+        _spans.clear()
+        _counters.clear()
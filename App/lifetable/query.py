@@ -0,0 +1,81 @@
+"""
+Query layer turning sidebar selections into filtered reads.
+
+Selections are pushed down to wherever the data lives: into the local backend (Parquet
+reader or SQL WHERE clause) when the local copy is fresh, otherwise into eq / in_
+filters on the Supabase query, so the rows loaded depend on the size of the selection
+rather than of the table. Paging and totals are pushed down the same way.
+"""
+from lifetable import store
+from lifetable.data import AggregatesUnavailable
+from lifetable.metrics import span
+from lifetable.sources import DataSource
+
+
+def query_table(table, columns=None, filters=None):
+    """
+    Load only the rows of a table matching filters.
+
+    table: Name of the Supabase table (e.g. 'PopulationData').
+    columns: Optional list of columns to load; all columns are loaded when None.
+    filters: Dict mapping column names to a value or a list of accepted values.
+    """
+    source = source_for(table)
+    with span('query.rows', table=table, source=type(source).__name__):
+        return source.query(table, columns, filters)
+
+
+def source_for(table):
+    """Return the DataSource queries on table should go to: the local copy when fresh, otherwise Supabase"""
+    return store.LOCAL_SOURCE if store.is_fresh(table) else store.REMOTE_SOURCE
+
+
+def count_matching(table, filters=None):
+    """Return the number of rows of a table matching filters without loading them"""
+    return source_for(table).count(table, filters)
+
+
+def query_page(table, columns=None, filters=None, offset=0, limit=100):
+    """
+    Load one window of the rows of a table matching filters.
+
+    Only the rows from offset to offset + limit are read or downloaded, so paging
+    through a selection costs the same however large the selection is.
+    """
+    source = source_for(table)
+    with span('query.page', table=table, source=type(source).__name__):
+        return source.page(table, columns, filters, offset, limit)
+
+
+def aggregate_table(table, by, sums, filters=None):
+    """
+    Sum columns of a table by group where the data lives.
+
+    by: Columns to group by (e.g. ['location_name', 'year']).
+    sums: Columns to sum within each group (e.g. ['total_deaths', 'population']).
+
+    Supabase projects do not allow aggregate functions by default; then only the
+    grouping and summed columns of the matching rows are downloaded and summed here.
+    """
+    source = source_for(table)
+    with span('query.aggregate', table=table, source=type(source).__name__):
+        try:
+            return source.aggregate(table, by, sums, filters)
+        except AggregatesUnavailable:
+            return DataSource.aggregate(source, table, by, sums, filters)
+
+
+def distinct_values(table, column):
+    """
+    Return the sorted distinct values of one column.
+
+    The values recorded when the table was cached are used when available, so building
+    the sidebar choices does not touch the data at all; otherwise the source looks them
+    up itself (SELECT DISTINCT locally, a grouped select on Supabase).
+    """
+    metadata = store.read_metadata(table)
+    if metadata is not None and column in metadata.get('distinct', {}):
+        return metadata['distinct'][column]
+    source = source_for(table)
+    with span('query.distinct', table=table, source=type(source).__name__):
+        return source.distinct(table, column)
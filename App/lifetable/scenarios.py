@@ -0,0 +1,166 @@
+"""
+What-if scenarios changing death rates by age.
+
+A scenario is a list of RateChange objects, each scaling and/or shifting nmx over a
+range of age groups. Instead of recalculating every column, update_life_tables starts
+from the observed tables: nqx is recalculated only for the changed age groups, lx, ndx
+and nLx only from the first changed age group onwards, and Tx below that age is shifted
+by the change in the years lived above it. Every population of the batch is updated in
+the same array operations.
+"""
+import numpy as np
+import pandas as pd
+from lifetable.ages import DEFAULT_SCHEMA
+from lifetable.metrics import incr, timed
+
+
+class RateChange:
+    """
+    A change of nmx over a range of age groups: nmx * factor + shift, never below zero.
+
+    first, last: Labels of the first and last age groups changed, inclusive.
+    factor: Multiplier of the death rates, e.g. 0.8 to cut mortality by 20%.
+    shift: Deaths per person-year added to the rates (negative to remove them).
+    """
+
+    def __init__(self, first, last, factor=1.0, shift=0.0):
+        self.first = first
+        self.last = last
+        self.factor = factor
+        self.shift = shift
+
+    def __repr__(self):
+        return f"RateChange({self.first!r}, {self.last!r}, factor={self.factor}, shift={self.shift})"
+
+    def positions(self, schema=DEFAULT_SCHEMA):
+        """Return the positions of the changed age groups in the schema"""
+        first, last = schema.position[self.first], schema.position[self.last]
+        if first > last:
+            raise ValueError(f"Age group {self.first!r} comes after {self.last!r}")
+        return np.arange(first, last + 1)
+
+
+def apply_changes(nmx, changes, schema=DEFAULT_SCHEMA):
+    """
+    Apply rate changes, in order, to an array of death rates.
+
+    nmx: Array of shape (populations, age groups).
+    changes: List of RateChange.
+
+    Returns:
+    The changed rates, and the sorted positions of the age groups that were changed.
+    """
+    nmx = np.array(nmx, dtype=float)
+    changed = set()
+    for change in changes:
+        positions = change.positions(schema)
+        nmx[:, positions] = np.clip(nmx[:, positions] * change.factor + change.shift, 0, None)
+        changed.update(positions.tolist())
+    return nmx, sorted(changed)
+
+
+def _keep_head(values, stop):
+    """Return a new array holding the first stop columns of values, the rest left to fill"""
+    out = np.empty_like(values)
+    out[:, :stop] = values[:, :stop]
+    return out
+
+
+@timed('scenarios.update')
+def update_life_tables(tables, nmx, changed):
+    """
+    Recalculate life tables whose death rates changed in some age groups.
+
+    tables: Observed life tables as returned by calculate_life_tables.
+    nmx: New death rates, with the shape of tables['nmx'].
+    changed: Sorted positions of the age groups whose rates changed.
+
+    Columns that cannot change are shared with tables rather than copied. The deaths
+    column holds the deaths implied by the new rates and the reported population.
+
+    Returns:
+    A dict of arrays like calculate_life_tables, equal to recalculating from scratch.
+    """
+    updated = dict(tables)
+    if not changed:
+        return updated
+    incr('scenarios.tables', len(nmx))
+    first = changed[0]
+    # A contiguous range of age groups is a slice, which avoids copies from fancy indexing
+    columns = slice(first, changed[-1] + 1) if changed[-1] - first + 1 == len(changed) else changed
+    n, nax = tables['n'][:, columns], tables['nax'][:, columns]
+
+    nmx = np.asarray(nmx, dtype=float)
+    rates = nmx[:, columns]
+    deaths = tables['deaths'].copy()
+    deaths[:, columns] = rates * tables['population'][:, columns]
+
+    nqx = tables['nqx'].copy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nqx[:, columns] = n * rates / (1 + (1 - nax) * rates * n)
+    npx = tables['npx'].copy()
+    npx[:, columns] = 1 - nqx[:, columns]
+
+    # Survivors up to the first changed age group are unaffected
+    lx = _keep_head(tables['lx'], first + 1)
+    np.cumprod(npx[:, first:-1], axis=1, out=lx[:, first + 1:])
+    lx[:, first + 1:] *= lx[:, first:first + 1]
+
+    ndx = _keep_head(tables['ndx'], first)
+    np.multiply(lx[:, first:], nqx[:, first:], out=ndx[:, first:])
+    ndx[:, -1] = lx[:, -1]
+
+    nLx = _keep_head(tables['nLx'], first)
+    widths, fractions = tables['n'][:, first:-1], tables['nax'][:, first:-1]
+    np.multiply(fractions, ndx[:, first:-1], out=nLx[:, first:-1])
+    nLx[:, first:-1] += lx[:, first + 1:]
+    nLx[:, first:-1] *= widths
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nLx[:, -1] = lx[:, -1] / nmx[:, -1]
+
+    # Above the first changed age group Tx is summed again; below it only shifts
+    Tx = np.empty_like(tables['Tx'])
+    Tx[:, first:] = np.cumsum(nLx[:, :first - 1 if first else None:-1], axis=1)[:, ::-1]
+    np.add(tables['Tx'][:, :first], (Tx[:, first] - tables['Tx'][:, first])[:, np.newaxis], out=Tx[:, :first])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ex = Tx / lx
+
+    updated.update({'deaths': deaths, 'nmx': nmx, 'nqx': nqx, 'npx': npx, 'lx': lx, 'ndx': ndx, 'nLx': nLx, 'Tx': Tx, 'ex': ex})
+    return updated
+
+
+def scenario_life_tables(tables, changes, schema=DEFAULT_SCHEMA):
+    """Return the life tables of a scenario, updated incrementally from the observed tables"""
+    nmx, changed = apply_changes(tables['nmx'], changes, schema)
+    return update_life_tables(tables, nmx, changed)
+
+
+def scenario_gains(groups, tables, scenario, ages=None, schema=DEFAULT_SCHEMA):
+    """
+    Compare ex between observed and scenario life tables.
+
+    groups: List of (location, sex, year) keys, one per row of the tables.
+    tables, scenario: Observed and scenario life tables.
+    ages: Age group labels to report ex at; defaults to the first age group (e0).
+
+    Returns:
+    A tidy DataFrame with the columns location_name, sex_name, year, age_name, ex,
+    ex_scenario and gain.
+    """
+    ages = list(ages) if ages else schema.labels[:1]
+    columns = ['location_name', 'sex_name', 'year', 'age_name', 'ex', 'ex_scenario', 'gain']
+    if not groups:
+        return pd.DataFrame(columns=columns)
+
+    positions = [schema.position[age] for age in ages]
+    location, sex, year = (np.array(values) for values in zip(*groups))
+    gains = pd.DataFrame({
+        'location_name': np.repeat(location, len(ages)),
+        'sex_name': np.repeat(sex, len(ages)),
+        'year': np.repeat(year, len(ages)),
+        'age_name': pd.Categorical(np.tile(ages, len(groups)), categories=ages),
+        'ex': tables['ex'][:, positions].ravel(),
+        'ex_scenario': scenario['ex'][:, positions].ravel(),
+    })
+    gains['gain'] = gains['ex_scenario'] - gains['ex']
+    return gains[columns]
@@ -0,0 +1,554 @@
+"""
+Interchangeable storage backends for the app's tables.
+
+Every backend answers the same filtered, column-projected queries, so the pages can
+read from Supabase, a local Parquet directory or a local SQLite / DuckDB file
+without any change. Filters are a dict mapping a column to a value (equality) or to
+a list of accepted values (membership), plus an optional (column, value) pair
+keeping only rows where column > value.
+"""
+import json
+import os
+import sqlite3
+import time
+import uuid
+import pandas as pd
+
+
+class DataSource:
+    """Interface shared by the storage backends"""
+
+    def query(self, table, columns=None, filters=None, newer_than=None):
+        """Return the rows of table matching filters, with only the requested columns"""
+        raise NotImplementedError
+
+    def count(self, table, filters=None):
+        """Return the number of rows of table matching filters"""
+        raise NotImplementedError
+
+    def distinct(self, table, column):
+        """Return the sorted distinct values of one column"""
+        return sorted(self.query(table, [column])[column].dropna().unique().tolist())
+
+    def page(self, table, columns=None, filters=None, offset=0, limit=100):
+        """Return one window of at most limit matching rows, starting at row offset"""
+        return self.query(table, columns, filters).iloc[offset:offset + limit].reset_index(drop=True)
+
+    def aggregate(self, table, by, sums, filters=None):
+        """Return the sums of columns sums for each group of columns by, ordered by group"""
+        df = self.query(table, list(by) + list(sums), filters)
+        return df.groupby(list(by), observed=True, sort=True)[list(sums)].sum().reset_index()
+
+    def has_table(self, table):
+        """Check whether the backend holds table"""
+        raise NotImplementedError
+
+    def write(self, table, df):
+        """Replace the contents of table with df"""
+        raise NotImplementedError(f"{type(self).__name__} is read-only")
+
+    def append(self, table, df):
+        """Add the rows of df to table, creating it when missing"""
+        raise NotImplementedError(f"{type(self).__name__} is read-only")
+
+    def upsert(self, table, df, keys):
+        """Add the rows of df to table, replacing the stored rows with the same values in the columns keys"""
+        raise NotImplementedError(f"{type(self).__name__} is read-only")
+
+    def read_metadata(self, table):
+        """Return the metadata stored with table, or None"""
+        return None
+
+    def write_metadata(self, table, metadata):
+        """Store a JSON-serialisable dict of metadata with table"""
+        raise NotImplementedError(f"{type(self).__name__} does not store metadata")
+
+
+class SupabaseSource(DataSource):
+    """The Supabase tables themselves, queried with server-side filters"""
+
+    # Seconds the distinct values of a column are reused before they are requested again
+    DISTINCT_TTL = float(os.getenv('LIFETABLE_DISTINCT_TTL', 300))
+
+    def __init__(self):
+        self._distinct = {}
+
+    def query(self, table, columns=None, filters=None, newer_than=None):
+        from lifetable.data import fetch_table
+
+        return fetch_table(table, columns, filters, newer_than)
+
+    def count(self, table, filters=None):
+        from lifetable.data import count_rows
+
+        return count_rows(table, filters)
+
+    def distinct(self, table, column):
+        from lifetable.data import distinct_rows
+
+        # The sidebars ask for the same few columns on every rerun
+        cached = self._distinct.get((table, column))
+        if cached is not None and time.time() - cached[0] < self.DISTINCT_TTL:
+            return cached[1]
+        values = distinct_rows(table, column)
+        self._distinct[(table, column)] = (time.time(), values)
+        return values
+
+    def page(self, table, columns=None, filters=None, offset=0, limit=100):
+        from lifetable.data import fetch_range
+
+        return fetch_range(table, columns, filters, offset, limit)
+
+    def aggregate(self, table, by, sums, filters=None):
+        from lifetable.data import aggregate_rows
+
+        return aggregate_rows(table, by, sums, filters)
+
+    def has_table(self, table):
+        return True
+
+
+def parquet_filters(filters=None, newer_than=None):
+    """Convert a dict of column filters into Parquet predicates"""
+    predicates = []
+    for column, value in (filters or {}).items():
+        if isinstance(value, (list, tuple, set)):
+            predicates.append((column, 'in', list(value)))
+        else:
+            predicates.append((column, '==', value))
+    if newer_than is not None:
+        predicates.append((newer_than[0], '>', newer_than[1]))
+    return predicates or None
+
+
+def _storage_frame(df):
+    """
+    Return df with plain column types: strings, 64-bit integers and 64-bit floats.
+
+    The compact dtypes of lifetable.data.compact_frame would otherwise be persisted as
+    DuckDB ENUMs or narrow Parquet integers, which later appends with new values or
+    larger numbers cannot be stored in. Readers compact the columns again.
+    """
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(values.cat.categories.dtype)
+        elif values.dtype.kind in 'iu':
+            # Nullable integers, e.g. DuckDB's for columns with NULLs, keep their missing values
+            values = values.astype('Int64' if isinstance(values.dtype, pd.api.extensions.ExtensionDtype) else 'int64')
+        elif values.dtype.kind == 'f':
+            values = values.astype('Float64' if isinstance(values.dtype, pd.api.extensions.ExtensionDtype) else 'float64')
+        columns[column] = values
+    return pd.DataFrame(columns, index=df.index)
+
+
+class ParquetSource(DataSource):
+    """
+    A directory holding one Parquet dataset directory per table.
+
+    Column and row filters are pushed into the Parquet reader. Metadata is kept in a
+    JSON file inside the table's directory.
+    """
+
+    # Rows per file written by write, so an upsert only rewrites the files holding its keys
+    PART_ROWS = 1000000
+    METADATA_FILE = '_cache.json'
+
+    def __init__(self, path):
+        self.path = path
+
+    def table_dir(self, table):
+        """Directory holding the dataset of a table"""
+        return os.path.join(self.path, table)
+
+    def query(self, table, columns=None, filters=None, newer_than=None):
+        from lifetable.data import compact_frame
+
+        # Columns are stored with plain types, see _storage_frame
+        return compact_frame(pd.read_parquet(self.table_dir(table), columns=columns, filters=parquet_filters(filters, newer_than)))
+
+    def _dataset(self, table, filters=None):
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+
+        predicates = parquet_filters(filters)
+        return ds.dataset(self.table_dir(table), format='parquet'), pq.filters_to_expression(predicates) if predicates else None
+
+    def count(self, table, filters=None):
+        # Counted from the row-group statistics and the filter columns only
+        dataset, expression = self._dataset(table, filters)
+        return dataset.count_rows(filter=expression)
+
+    def page(self, table, columns=None, filters=None, offset=0, limit=100):
+        from lifetable.data import compact_frame
+
+        # Only the rows of the window are converted to pandas
+        dataset, expression = self._dataset(table, filters)
+        scanner = dataset.scanner(columns=columns, filter=expression)
+        total = dataset.count_rows(filter=expression)
+        window = list(range(offset, min(offset + limit, total)))
+        return compact_frame(scanner.take(window).to_pandas() if window else scanner.head(0).to_pandas())
+
+    def aggregate(self, table, by, sums, filters=None):
+        from lifetable.data import compact_frame
+
+        # Grouped and summed by Arrow before anything is converted to pandas
+        dataset, expression = self._dataset(table, filters)
+        grouped = dataset.to_table(columns=list(by) + list(sums), filter=expression).group_by(list(by))
+        df = grouped.aggregate([(column, 'sum') for column in sums]).to_pandas()
+        df = df.rename(columns={f'{column}_sum': column for column in sums})[list(by) + list(sums)]
+        return compact_frame(df.sort_values(list(by)).reset_index(drop=True))
+
+    def has_table(self, table):
+        directory = self.table_dir(table)
+        return os.path.isdir(directory) and any(name.endswith('.parquet') and not name.startswith(('.', '_'))
+                                                for name in os.listdir(directory))
+
+    def _parts(self, table):
+        """Return the paths of the Parquet files making up the dataset of a table"""
+        directory = self.table_dir(table)
+        return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                if name.endswith('.parquet') and not name.startswith(('.', '_'))]
+
+    def _write_part(self, path, batch):
+        """Write an Arrow table to path through a hidden temporary file, so readers never see a partial file"""
+        import pyarrow.parquet as pq
+
+        directory, name = os.path.split(path)
+        temporary = os.path.join(directory, '.' + name + '.tmp')
+        pq.write_table(batch, temporary)
+        os.replace(temporary, path)
+
+    def write(self, table, df):
+        import pyarrow as pa
+
+        directory = self.table_dir(table)
+        os.makedirs(directory, exist_ok=True)
+
+        # One Arrow table sliced into parts, so every part has the same schema
+        batch = pa.Table.from_pandas(_storage_frame(df), preserve_index=False)
+        names = []
+        for number, start in enumerate(range(0, max(len(batch), 1), self.PART_ROWS)):
+            names.append(f'part-{number}.parquet')
+            self._write_part(os.path.join(directory, names[-1]), batch.slice(start, self.PART_ROWS))
+
+        # The new files replace every other part of the dataset
+        for path in self._parts(table):
+            if os.path.basename(path) not in names:
+                os.remove(path)
+
+    def append(self, table, df):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        if not self.has_table(table):
+            self.write(table, df)
+            return
+        directory = self.table_dir(table)
+
+        # Every part must share the dataset's schema: add missing columns as nulls and cast the rest
+        schema = ds.dataset(directory, format='parquet').schema
+        extra = [column for column in df.columns if column not in schema.names]
+        if extra:
+            raise ValueError(f"Columns {extra} are not in the stored {table} table")
+        batch = pa.Table.from_pandas(_storage_frame(df), preserve_index=False)
+        try:
+            batch = pa.Table.from_arrays([batch[field.name].cast(field.type) if field.name in batch.column_names
+                                          else pa.nulls(len(batch), field.type) for field in schema], schema=schema)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            # Datasets written with compact types may be too narrow for the new rows: rewrite them once
+            self.write(table, pd.concat([self.query(table), df], ignore_index=True))
+            return
+
+        self._write_part(os.path.join(directory, f'part-{uuid.uuid4().hex}.parquet'), batch)
+
+    def upsert(self, table, df, keys):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self.has_table(table):
+            self.write(table, df)
+            return
+
+        # Only the key columns of rows that may match are read to find the parts holding the keys
+        incoming = pd.MultiIndex.from_frame(_storage_frame(df[keys]))
+        predicates = parquet_filters({column: sorted(set(df[column].dropna().tolist())) for column in keys})
+        for path in self._parts(table):
+            stored = _storage_frame(pq.read_table(path, columns=keys, filters=predicates).to_pandas())
+            if stored.empty or not pd.MultiIndex.from_frame(stored).isin(incoming).any():
+                continue
+            # Rewrite just this part without the replaced rows, keeping its schema
+            part = pq.read_table(path)
+            replaced = pd.MultiIndex.from_frame(_storage_frame(part.select(keys).to_pandas())).isin(incoming)
+            if replaced.all():
+                os.remove(path)
+            else:
+                self._write_part(path, part.filter(pa.array(~replaced)))
+        self.append(table, df)
+
+    def read_metadata(self, table):
+        try:
+            with open(os.path.join(self.table_dir(table), self.METADATA_FILE)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def write_metadata(self, table, metadata):
+        os.makedirs(self.table_dir(table), exist_ok=True)
+        path = os.path.join(self.table_dir(table), self.METADATA_FILE)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(metadata, file)
+        os.replace(path + '.tmp', path)
+
+
+def _quote(identifier):
+    """Quote a table or column name for SQL"""
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+def sql_where(filters=None, newer_than=None):
+    """Build a parameterised WHERE clause from a dict of column filters"""
+    clauses = []
+    params = []
+    for column, value in (filters or {}).items():
+        if isinstance(value, (list, tuple, set)):
+            value = list(value)
+            if not value:
+                clauses.append('1 = 0')
+                continue
+            clauses.append(f"{_quote(column)} IN ({', '.join('?' * len(value))})")
+            params.extend(_python_value(item) for item in value)
+        else:
+            clauses.append(f"{_quote(column)} = ?")
+            params.append(_python_value(value))
+    if newer_than is not None:
+        clauses.append(f"{_quote(newer_than[0])} > ?")
+        params.append(_python_value(newer_than[1]))
+    return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+
+def _python_value(value):
+    """Convert NumPy scalars into the Python values database drivers accept"""
+    return value.item() if hasattr(value, 'item') else value
+
+
+class SQLiteSource(DataSource):
+    """
+    A local SQLite database file with one SQL table per table.
+
+    Filters become a parameterised WHERE clause; metadata is kept in a
+    _lifetable_metadata table.
+    """
+
+    METADATA_TABLE = '_lifetable_metadata'
+
+    # Columns indexed after a write so filtered queries do not scan the table
+    INDEX_COLUMNS = ['location_name', 'sex_name', 'year']
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        # A connection per call keeps the source safe to share between threads
+        return sqlite3.connect(self.path)
+
+    def _read_sql(self, sql, params):
+        with self.connect() as connection:
+            return pd.read_sql_query(sql, connection, params=params)
+
+    def query(self, table, columns=None, filters=None, newer_than=None):
+        select = ', '.join(_quote(column) for column in columns) if columns else '*'
+        where, params = sql_where(filters, newer_than)
+        if columns == []:
+            # No columns requested: still return one (empty) row per match
+            return pd.DataFrame(index=range(self.count(table, filters)))
+        from lifetable.data import compact_frame
+
+        # SQL results come back as plain object and 64-bit columns
+        return compact_frame(self._read_sql(f"SELECT {select} FROM {_quote(table)}{where}", params))
+
+    def count(self, table, filters=None):
+        where, params = sql_where(filters)
+        return int(self._read_sql(f"SELECT COUNT(*) AS n FROM {_quote(table)}{where}", params)['n'].iloc[0])
+
+    def page(self, table, columns=None, filters=None, offset=0, limit=100):
+        from lifetable.data import compact_frame
+
+        select = ', '.join(_quote(column) for column in columns) if columns else '*'
+        where, params = sql_where(filters)
+        # Rows keep the order they were written in
+        sql = f"SELECT {select} FROM {_quote(table)}{where} ORDER BY rowid LIMIT ? OFFSET ?"
+        return compact_frame(self._read_sql(sql, params + [int(limit), int(offset)]))
+
+    def aggregate(self, table, by, sums, filters=None):
+        from lifetable.data import compact_frame
+
+        groups = ', '.join(_quote(column) for column in by)
+        totals = ', '.join(f"SUM({_quote(column)}) AS {_quote(column)}" for column in sums)
+        where, params = sql_where(filters)
+        sql = f"SELECT {groups}, {totals} FROM {_quote(table)}{where} GROUP BY {groups} ORDER BY {groups}"
+        return compact_frame(self._read_sql(sql, params))
+
+    def distinct(self, table, column):
+        frame = self._read_sql(f"SELECT DISTINCT {_quote(column)} FROM {_quote(table)} WHERE {_quote(column)} IS NOT NULL", [])
+        return sorted(frame[column].tolist())
+
+    def has_table(self, table):
+        if not os.path.exists(self.path):
+            return False
+        frame = self._read_sql("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", [table])
+        return not frame.empty
+
+    def write(self, table, df):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self.connect() as connection:
+            _storage_frame(df).to_sql(table, connection, if_exists='replace', index=False)
+            self._create_index(connection, table, df)
+
+    def append(self, table, df):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self.connect() as connection:
+            _storage_frame(df).to_sql(table, connection, if_exists='append', index=False)
+            self._create_index(connection, table, df)
+
+    def upsert(self, table, df, keys):
+        if not self.has_table(table):
+            self.write(table, df)
+            return
+        frame = _storage_frame(df)
+        where = ' AND '.join(f"{_quote(column)} = ?" for column in keys)
+        with self.connect() as connection:
+            # Each key is found through the (location, sex, year) index
+            connection.executemany(f"DELETE FROM {_quote(table)} WHERE {where}", frame[keys].drop_duplicates().values.tolist())
+            frame.to_sql(table, connection, if_exists='append', index=False)
+
+    def _create_index(self, connection, table, df):
+        columns = [column for column in self.INDEX_COLUMNS if column in df]
+        if columns:
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {_quote('idx_' + table + '_groups')} "
+                               f"ON {_quote(table)} ({', '.join(_quote(column) for column in columns)})")
+
+    def read_metadata(self, table):
+        if not self.has_table(self.METADATA_TABLE):
+            return None
+        frame = self._read_sql(f"SELECT metadata FROM {_quote(self.METADATA_TABLE)} WHERE name = ?", [table])
+        return json.loads(frame['metadata'].iloc[0]) if not frame.empty else None
+
+    def write_metadata(self, table, metadata):
+        with self.connect() as connection:
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {_quote(self.METADATA_TABLE)} (name TEXT PRIMARY KEY, metadata TEXT)")
+            connection.execute(f"DELETE FROM {_quote(self.METADATA_TABLE)} WHERE name = ?", [table])
+            connection.execute(f"INSERT INTO {_quote(self.METADATA_TABLE)} VALUES (?, ?)", [table, json.dumps(metadata)])
+
+
+class DuckDBSource(SQLiteSource):
+    """A local DuckDB database file; queries run on DuckDB's columnar engine (requires the duckdb package)"""
+
+    def connect(self):
+        import duckdb
+
+        return duckdb.connect(self.path)
+
+    def _read_sql(self, sql, params):
+        connection = self.connect()
+        try:
+            return connection.execute(sql, params).df()
+        finally:
+            connection.close()
+
+    def has_table(self, table):
+        if not os.path.exists(self.path):
+            return False
+        frame = self._read_sql("SELECT table_name FROM information_schema.tables WHERE table_name = ?", [table])
+        return not frame.empty
+
+    def write(self, table, df):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = self.connect()
+        try:
+            # Plain types give VARCHAR, BIGINT and DOUBLE columns rather than ENUMs that reject new values
+            connection.register('frame', _storage_frame(df))
+            connection.execute(f"CREATE OR REPLACE TABLE {_quote(table)} AS SELECT * FROM frame")
+            connection.unregister('frame')
+            self._create_index(connection, table, df)
+        finally:
+            connection.close()
+
+    def append(self, table, df):
+        import duckdb
+
+        if not self.has_table(table):
+            self.write(table, df)
+            return
+        connection = self.connect()
+        try:
+            connection.register('frame', _storage_frame(df))
+            columns = ', '.join(_quote(column) for column in df.columns)
+            connection.execute(f"INSERT INTO {_quote(table)} ({columns}) SELECT {columns} FROM frame")
+            connection.unregister('frame')
+            return
+        except duckdb.ConversionException:
+            # Tables written with ENUM columns cannot take new values: rewrite them once with plain types
+            pass
+        finally:
+            connection.close()
+        self.write(table, pd.concat([self.query(table), df], ignore_index=True))
+
+    def upsert(self, table, df, keys):
+        import duckdb
+
+        if not self.has_table(table):
+            self.write(table, df)
+            return
+        connection = self.connect()
+        try:
+            connection.register('frame', _storage_frame(df))
+            columns = ', '.join(_quote(column) for column in df.columns)
+            matches = ' AND '.join(f"{_quote(table)}.{_quote(column)} = frame.{_quote(column)}" for column in keys)
+            connection.execute("BEGIN TRANSACTION")
+            connection.execute(f"DELETE FROM {_quote(table)} USING frame WHERE {matches}")
+            connection.execute(f"INSERT INTO {_quote(table)} ({columns}) SELECT {columns} FROM frame")
+            connection.execute("COMMIT")
+            connection.unregister('frame')
+            return
+        except duckdb.ConversionException:
+            # Tables written with ENUM columns cannot take new values: rewrite them once with plain types
+            connection.execute("ROLLBACK")
+        finally:
+            connection.close()
+        merged = pd.concat([self.query(table), df], ignore_index=True)
+        self.write(table, merged.drop_duplicates(subset=keys, keep='last').reset_index(drop=True))
+
+    def write_metadata(self, table, metadata):
+        connection = self.connect()
+        try:
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {_quote(self.METADATA_TABLE)} (name TEXT PRIMARY KEY, metadata TEXT)")
+            connection.execute(f"DELETE FROM {_quote(self.METADATA_TABLE)} WHERE name = ?", [table])
+            connection.execute(f"INSERT INTO {_quote(self.METADATA_TABLE)} VALUES (?, ?)", [table, json.dumps(metadata)])
+        finally:
+            connection.close()
+
+
+# Backends that can serve as the local store: name -> (class, default file name under the cache directory)
+LOCAL_BACKENDS = {
+    'parquet': (ParquetSource, ''),
+    'sqlite': (SQLiteSource, 'lifetable.sqlite'),
+    'duckdb': (DuckDBSource, 'lifetable.duckdb'),
+}
+
+
+def open_source(backend, path=None, cache_dir=None):
+    """
+    Create the DataSource for a backend name.
+
+    backend: 'supabase', 'parquet', 'sqlite' or 'duckdb'.
+    path: Directory (Parquet) or database file (SQLite / DuckDB) of a local backend;
+    defaults to a location inside cache_dir.
+    """
+    if backend == 'supabase':
+        return SupabaseSource()
+    if backend not in LOCAL_BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected 'supabase' or one of {sorted(LOCAL_BACKENDS)}")
+    source_class, default_name = LOCAL_BACKENDS[backend]
+    return source_class(path or os.path.join(cache_dir or '.', default_name))
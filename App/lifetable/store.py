@@ -0,0 +1,314 @@
+"""
+Local copy of the Supabase tables.
+
+Each table is kept in a local storage backend (a Parquet directory by default, or a
+SQLite / DuckDB file, see lifetable.sources) together with metadata recording when it
+was fetched. Pages read the local copy and only go back to Supabase when it is older
+than the TTL or a refresh is requested; with an infinite TTL only an explicit sync or
+refresh touches Supabase, so the app runs fully offline.
+
+Rows ingested from extracts are also kept in a separate <table>_ingested table, which
+downloads and syncs merge back in, so a refresh never loses them.
+"""
+import os
+import threading
+import time
+import pandas as pd
+from lifetable.data import compact_frame
+from lifetable.index import GROUP_COLUMNS, sort_groups
+from lifetable.metrics import timed
+from lifetable.sources import SupabaseSource, open_source
+
+CACHE_DIR = os.getenv('LIFETABLE_CACHE_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache'))
+CACHE_TTL = float(os.getenv('LIFETABLE_CACHE_TTL', 24 * 60 * 60))  # seconds
+
+# Backend holding the local copy: 'parquet', 'sqlite', 'duckdb', or 'supabase' to keep no
+# local copy and always query Supabase directly
+BACKEND = os.getenv('LIFETABLE_BACKEND', 'parquet')
+BACKEND_PATH = os.getenv('LIFETABLE_BACKEND_PATH')
+
+# Column whose largest cached value marks how far the cache is in sync with Supabase,
+# e.g. the primary key or an updated-at timestamp
+WATERMARK_COLUMN = os.getenv('LIFETABLE_WATERMARK_COLUMN', os.getenv('LIFETABLE_ORDER_COLUMN', 'id'))
+
+# Columns identifying one row
+KEY_COLUMNS = GROUP_COLUMNS + ['age_name']
+
+# Columns whose distinct values are recorded in the metadata for the sidebar choices
+DIMENSION_COLUMNS = ['year', 'location_name', 'sex_name', 'age_name']
+
+# Suffix of the table keeping the ingested rows of a table
+INGESTED_SUFFIX = '_ingested'
+
+# Where the data comes from, and where the local copy is kept (None without one)
+REMOTE_SOURCE = SupabaseSource()
+LOCAL_SOURCE = None if BACKEND == 'supabase' else open_source(BACKEND, BACKEND_PATH, CACHE_DIR)
+
+_refresh_lock = threading.Lock()
+_prefetch_lock = threading.Lock()
+_prefetches = {}
+_prefetch_errors = {}
+_refresh_listeners = {}
+
+# Seconds to wait before retrying a failed background download
+PREFETCH_RETRY = 60
+
+
+def add_refresh_listener(table, callback):
+    """
+    Call callback(groups) whenever the local copy of a table changes.
+
+    groups is the list of (location, sex, year) groups that changed, or None when the
+    whole table was replaced.
+    """
+    _refresh_listeners.setdefault(table, []).append(callback)
+
+
+def _notify(table, groups=None):
+    for callback in _refresh_listeners.get(table, []):
+        callback(groups)
+
+
+def read_metadata(table):
+    """Return the cache metadata of a table, or None when it has not been cached"""
+    if LOCAL_SOURCE is None:
+        return None
+    return LOCAL_SOURCE.read_metadata(table)
+
+
+def write_metadata(table, metadata):
+    """Atomically replace the cache metadata of a table"""
+    LOCAL_SOURCE.write_metadata(table, metadata)
+
+
+def is_fresh(table, ttl=None):
+    """Check whether the cached copy of a table exists and is younger than the TTL"""
+    metadata = read_metadata(table)
+    if metadata is None or not LOCAL_SOURCE.has_table(table):
+        return False
+    ttl = CACHE_TTL if ttl is None else ttl
+    return time.time() - metadata['fetched_at'] < ttl
+
+
+def ingested_table(table):
+    """Return the name of the table keeping the rows ingested into table"""
+    return table + INGESTED_SUFFIX
+
+
+def _watermark(df):
+    """Return the largest WATERMARK_COLUMN value of df as a Python value, or None"""
+    if WATERMARK_COLUMN not in df or df[WATERMARK_COLUMN].isna().all():
+        return None
+    watermark = df[WATERMARK_COLUMN].max()
+    return watermark.item() if hasattr(watermark, 'item') else watermark
+
+
+@timed('store.write')
+def write_table(table, df, **metadata):
+    """Replace the cached copy of a table with df"""
+    # Store rows ordered by group and age so readers never need to sort them
+    if 'age_name' in df and all(column in df for column in GROUP_COLUMNS):
+        df = sort_groups(df)
+
+    LOCAL_SOURCE.write(table, df)
+
+    distinct = {column: sorted(df[column].dropna().unique().tolist()) for column in DIMENSION_COLUMNS if column in df}
+    watermark = _watermark(df)
+    if watermark is not None:
+        metadata.setdefault('watermark', watermark)
+    write_metadata(table, {'fetched_at': time.time(), 'rows': len(df), 'distinct': distinct, **metadata})
+
+
+def _upsert(table, df):
+    """
+    Add the rows of df to a table of the local store, replacing stored rows with the same key.
+
+    The backend deletes the stored rows sharing a (location, sex, year, age) key and
+    appends the new ones, without reading or rewriting the rest of the table.
+    """
+    if all(column in df for column in KEY_COLUMNS):
+        LOCAL_SOURCE.upsert(table, df, KEY_COLUMNS)
+    else:
+        LOCAL_SOURCE.append(table, df)
+
+
+def _merge_ingested(table, df):
+    """Return df with the ingested rows of table merged in, each replacing the row with the same key"""
+    ingested = ingested_table(table)
+    if LOCAL_SOURCE is None or not LOCAL_SOURCE.has_table(ingested):
+        return df
+    merged = pd.concat([df, LOCAL_SOURCE.query(ingested)], ignore_index=True)
+    return compact_frame(merged.drop_duplicates(subset=KEY_COLUMNS, keep='last').reset_index(drop=True))
+
+
+@timed('store.append')
+def append_table(table, df):
+    """
+    Upsert rows into the local copy of a table, e.g. from an ingested extract.
+
+    Rows replace stored rows with the same (location, sex, year, age) key, so loading
+    an extract again does not duplicate its groups. The rows are also upserted into
+    ingested_table(table), from which downloads and syncs merge them back. The
+    metadata row count and distinct values are updated, and any cached life tables of
+    the (location, sex, year) groups involved are invalidated.
+    """
+    from lifetable.cache import LIFE_TABLE_CACHE
+
+    if LOCAL_SOURCE is None:
+        raise ValueError("The supabase backend keeps no local copy to append to")
+    if df.empty:
+        return
+    if 'age_name' in df and all(column in df for column in GROUP_COLUMNS):
+        df = sort_groups(df)
+
+    with _refresh_lock:
+        # Ingested rows alone are not a copy of Supabase, so they never count as fresh
+        metadata = read_metadata(table) or {'fetched_at': 0, 'distinct': {}}
+        _upsert(ingested_table(table), df)
+        _upsert(table, df)
+
+        distinct = metadata.get('distinct', {})
+        for column in DIMENSION_COLUMNS:
+            if column in df:
+                distinct[column] = sorted(set(distinct.get(column, [])) | set(df[column].dropna().unique().tolist()))
+        write_metadata(table, {**metadata, 'rows': LOCAL_SOURCE.count(table), 'distinct': distinct})
+
+    if all(column in df for column in GROUP_COLUMNS):
+        groups = [tuple(group) for group in df[GROUP_COLUMNS].drop_duplicates().values.tolist()]
+        LIFE_TABLE_CACHE.invalidate(groups)
+        _notify(table, groups)
+
+
+@timed('store.download')
+def _download(table):
+    from lifetable.cache import LIFE_TABLE_CACHE
+
+    df = REMOTE_SOURCE.query(table)
+    if LOCAL_SOURCE is not None:
+        # The watermark only covers the rows from Supabase
+        write_table(table, _merge_ingested(table, df), watermark=_watermark(df))
+    LIFE_TABLE_CACHE.invalidate()
+    _notify(table)
+    return df
+
+
+def refresh_table(table):
+    """Download a table from Supabase and replace its cached copy"""
+    with _refresh_lock:
+        return _download(table)
+
+
+def prefetch_table(table, ttl=None):
+    """
+    Start downloading a missing or stale table in a background thread, without waiting for it.
+
+    At most one download per table runs at a time, shared by every session; pages keep
+    querying Supabase directly until the local copy is fresh.
+
+    Returns:
+    True while a background download of the table is running.
+    """
+    if LOCAL_SOURCE is None or is_fresh(table, ttl):
+        return False
+
+    def download():
+        try:
+            with _refresh_lock:
+                if not is_fresh(table, ttl):
+                    _download(table)
+            _prefetch_errors.pop(table, None)
+        except Exception as error:
+            _prefetch_errors[table] = (time.time(), error)
+
+    failed = _prefetch_errors.get(table)
+    if failed is not None and time.time() - failed[0] < PREFETCH_RETRY:
+        return False
+
+    # A separate lock, so the page never waits for a download holding _refresh_lock
+    with _prefetch_lock:
+        thread = _prefetches.get(table)
+        if thread is None or not thread.is_alive():
+            thread = _prefetches[table] = threading.Thread(target=download, name=f'prefetch-{table}', daemon=True)
+            thread.start()
+    return True
+
+
+def prefetch_error(table):
+    """Return the error of the last failed background download of a table, or None"""
+    failed = _prefetch_errors.get(table)
+    return failed[1] if failed is not None else None
+
+
+def read_table(table, columns=None, filters=None):
+    """Read the cached copy of a table, pushing column and row filters into the local backend"""
+    if LOCAL_SOURCE is None:
+        return REMOTE_SOURCE.query(table, columns, filters)
+    return LOCAL_SOURCE.query(table, columns, filters)
+
+
+def load_table(table, columns=None, refresh=False, ttl=None):
+    """
+    Load a table from the local cache, refreshing it from Supabase when needed.
+
+    table: Name of the Supabase table (e.g. 'PopulationData').
+    columns: Optional list of columns to read; all columns are read when None.
+    refresh: Force a download from Supabase even if the cache is fresh.
+    ttl: Maximum age of the cache in seconds, defaults to CACHE_TTL.
+    """
+    if LOCAL_SOURCE is None:
+        return REMOTE_SOURCE.query(table, columns)
+    if refresh:
+        refresh_table(table)
+    elif not is_fresh(table, ttl):
+        with _refresh_lock:
+            # Another session may have refreshed the table while we waited for the lock
+            if not is_fresh(table, ttl):
+                _download(table)
+    return read_table(table, columns)
+
+
+@timed('store.sync')
+def sync_table(table):
+    """
+    Bring the cached copy of a table up to date with only the rows added or changed since the last sync.
+
+    Rows with a WATERMARK_COLUMN value above the recorded watermark are downloaded and
+    upserted by (location, sex, year, age), after which ingested rows are merged back
+    in. The (location, sex, year) groups they touch
+    are recorded in the metadata as 'changed_groups' so downstream caches can be
+    invalidated selectively.
+
+    Returns:
+    A list of the changed (location_name, sex_name, year) groups, or None when the
+    whole table had to be downloaded because there was nothing to sync from (or
+    nothing was done because the Supabase backend keeps no local copy).
+    """
+    from lifetable.cache import LIFE_TABLE_CACHE
+
+    if LOCAL_SOURCE is None:
+        return None
+
+    with _refresh_lock:
+        metadata = read_metadata(table)
+        if metadata is None or metadata.get('watermark') is None:
+            _download(table)
+            return None
+
+        new_rows = REMOTE_SOURCE.query(table, newer_than=(WATERMARK_COLUMN, metadata['watermark']))
+        if new_rows.empty:
+            write_metadata(table, {**metadata, 'fetched_at': time.time(), 'changed_groups': []})
+            return []
+        changed_groups = [tuple(group) for group in new_rows[GROUP_COLUMNS].drop_duplicates().values.tolist()]
+
+        # Upsert: the newly fetched row wins for every (location, sex, year, age) key
+        merged = pd.concat([read_table(table), new_rows], ignore_index=True)
+        merged = merged.drop_duplicates(subset=KEY_COLUMNS, keep='last').reset_index(drop=True)
+        # Concatenating categoricals with different categories falls back to object columns
+        merged = _merge_ingested(table, compact_frame(merged))
+
+        watermark = max(metadata['watermark'], new_rows[WATERMARK_COLUMN].max())
+        write_table(table, merged, watermark=watermark.item() if hasattr(watermark, 'item') else watermark,
+                    changed_groups=[list(group) for group in changed_groups])
+        LIFE_TABLE_CACHE.invalidate(changed_groups)
+    _notify(table, changed_groups)
+    return changed_groups
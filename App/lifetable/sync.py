@@ -0,0 +1,27 @@
+"""
+Command to sync the local cache with Supabase.
+
+Usage (from the App directory):
+    python -m lifetable.sync [TABLE ...]
+"""
+import argparse
+from lifetable.store import sync_table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch rows added or changed in Supabase into the local cache.")
+    parser.add_argument('tables', nargs='*', default=['PopulationData'], help="Tables to sync (default: PopulationData)")
+    args = parser.parse_args(argv)
+
+    for table in args.tables:
+        changed_groups = sync_table(table)
+        if changed_groups is None:
+            print(f"{table}: downloaded the full table")
+        else:
+            print(f"{table}: {len(changed_groups)} (location, sex, year) groups changed")
+            for group in changed_groups:
+                print("  " + ", ".join(str(value) for value in group))
+
+
+if __name__ == '__main__':
+    main()
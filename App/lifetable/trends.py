@@ -0,0 +1,45 @@
+"""
+Life expectancy over time.
+
+Every available year of the chosen countries and sexes is calculated in one batched
+engine call and returned as a tidy series, ready to chart.
+"""
+import numpy as np
+import pandas as pd
+from lifetable.cache import cached_life_tables
+from lifetable.metrics import timed
+
+
+@timed('trends.life_expectancy')
+def life_expectancy_trends(index, ages=None, groups=None):
+    """
+    Return ex at the chosen ages for every group of an index.
+
+    index: GroupIndex holding the population data of every year involved.
+    ages: Age group labels to report ex at; defaults to the first age group (e0).
+    groups: Optional list of (location, sex, year) keys; all groups of the index when None.
+
+    Returns:
+    A tidy DataFrame with the columns location_name, sex_name, year, age_name and ex,
+    ordered by location, sex, age group and year.
+    """
+    schema = index.schema
+    ages = list(ages) if ages else schema.labels[:1]
+    groups = index.keys if groups is None else list(groups)
+    columns = ['location_name', 'sex_name', 'year', 'age_name', 'ex']
+    if not groups:
+        return pd.DataFrame(columns=columns)
+
+    tables = cached_life_tables(groups, index.stack('total_deaths', groups), index.stack('population', groups), schema=schema)
+    positions = [schema.position[age] for age in ages]
+    ex = tables['ex'][:, positions]
+
+    location, sex, year = (np.array(values) for values in zip(*groups))
+    trends = pd.DataFrame({
+        'location_name': np.repeat(location, len(ages)),
+        'sex_name': np.repeat(sex, len(ages)),
+        'year': np.repeat(year, len(ages)),
+        'age_name': pd.Categorical(np.tile(ages, len(groups)), categories=ages),
+        'ex': ex.ravel(),
+    })
+    return trends.sort_values(['location_name', 'sex_name', 'age_name', 'year'], kind='stable').reset_index(drop=True)[columns]
@@ -0,0 +1,104 @@
+"""Streamlit widgets shared by the pages."""
+from datetime import datetime
+import streamlit as st
+
+
+def data_refresh_button(table):
+    """
+    Sidebar button that re-downloads a cached table, with the age of the local copy.
+
+    A missing or stale local copy is downloaded in the background, so the page renders
+    straight away and queries Supabase until the download completes. Life tables are
+    precomputed in the background once the local copy is there, with a progress bar.
+    """
+    # Imported here so pages without data (e.g. the main page) never load pandas
+    from lifetable.store import prefetch_error, prefetch_table, read_metadata, refresh_table
+    from lifetable.warm import start_warming
+
+    if st.sidebar.button('Refresh data'):
+        with st.spinner(f'Downloading {table} from Supabase...'):
+            refresh_table(table)
+
+    downloading = prefetch_table(table)
+    metadata = read_metadata(table)
+    if metadata is not None:
+        fetched_at = datetime.fromtimestamp(metadata['fetched_at']).strftime('%Y-%m-%d %H:%M')
+        st.sidebar.caption(f"Local copy of {table} from {fetched_at}")
+    if downloading:
+        st.sidebar.caption(f"Downloading a local copy of {table} in the background...")
+    elif prefetch_error(table) is not None:
+        st.sidebar.caption(f"Background download of {table} failed: {prefetch_error(table)}")
+
+    warmer = start_warming(table)
+    if warmer is not None and warmer.state == 'running' and warmer.total:
+        st.sidebar.progress(warmer.done / warmer.total, text=f"Precomputing life tables: {warmer.done:,} of {warmer.total:,}")
+
+
+def track_views(locations, key='viewed_locations'):
+    """
+    Count a view of the selected locations whenever the selection changes.
+
+    Reruns with an unchanged selection are not counted. The counts order the background
+    precompute, most-viewed locations first.
+    """
+    from lifetable.warm import record_views
+
+    locations = [locations] if isinstance(locations, str) else list(locations or [])
+    if st.session_state.get(key) != locations:
+        st.session_state[key] = locations
+        record_views(locations)
+
+
+def start_background_warming(table):
+    """Start precomputing the life tables of a table from a page without data, off the page's thread"""
+    import threading
+
+    def start():
+        from lifetable.warm import start_warming
+
+        start_warming(table)
+
+    threading.Thread(target=start, name=f'start-warming-{table}', daemon=True).start()
+
+
+def dataframe(df, **kwargs):
+    """st.dataframe, timed as a render.dataframe span"""
+    from lifetable.metrics import span
+
+    with span('render.dataframe', rows=len(df)):
+        st.dataframe(df, **kwargs)
+
+
+def metrics_panel():
+    """Sidebar debug panel with the timing spans and counters, shown when LIFETABLE_METRICS is on"""
+    from lifetable import metrics
+
+    if not metrics.ENABLED:
+        return
+    import pandas as pd
+
+    with st.sidebar.expander('Timings'):
+        if st.button('Reset timings'):
+            metrics.reset()
+        snapshot = metrics.snapshot()
+        st.caption("Seconds per stage since the server started, across all sessions")
+        st.dataframe(pd.DataFrame.from_dict(snapshot['spans'], orient='index').sort_values('total_s', ascending=False)
+                     if snapshot['spans'] else pd.DataFrame())
+        st.caption("Counters")
+        st.dataframe(pd.Series(snapshot['counters'], name='total', dtype=float))
+
+
+@st.fragment(run_every=1)
+def _clock():
+    st.markdown(f"**Current Time:** {datetime.now().strftime('%H:%M:%S')}")
+
+
+def sidebar_clock():
+    """
+    Sidebar clock ticking every second.
+
+    Only this fragment reruns, on a timer driven by the browser, so there is no server
+    thread per session and nothing is left running once the session ends.
+    """
+    with st.sidebar:
+        _clock()
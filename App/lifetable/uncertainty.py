@@ -0,0 +1,164 @@
+"""
+Confidence intervals for life expectancy and its decomposition.
+
+Two methods are offered. The analytic one uses Chiang's variance of the probability
+of dying, var(nqx) = nqx^2 (1 - nqx) / nDx, propagated to ex as in Chiang (1984) and
+Silcocks et al. (2001), with the open-ended age group's term from the variance of its
+death rate. The Monte Carlo one redraws every death count from a Poisson distribution
+around the observed count and recalculates all replicate life tables in batched
+calls to calculate_life_tables.
+"""
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+from lifetable.decomposition import arriaga_contributions
+from lifetable.ages import DEFAULT_SCHEMA
+from lifetable.engine import COLUMN_LABELS, calculate_life_tables
+from lifetable.metrics import timed
+
+REPLICATES = 1000
+
+# Largest number of replicate life tables calculated in one call, to bound memory
+MAX_BATCH_ROWS = 50000
+
+
+def chiang_variance(tables):
+    """
+    Return the Chiang variance of ex for every life table and age group.
+
+    tables: Life tables as returned by calculate_life_tables.
+
+    Returns:
+    An array of the same shape as tables['ex']. Age groups without deaths add no variance.
+    """
+    n, nax, nqx = tables['n'], tables['nax'], tables['nqx']
+    deaths, population, nmx = tables['deaths'], tables['population'], tables['nmx']
+    lx, ex = tables['lx'], tables['ex']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # nqx can exceed 1 at very high death rates; those age groups add no variance
+        variance_q = np.where(deaths > 0, nqx ** 2 * np.clip(1 - nqx, 0, None) / deaths, 0.0)
+        # Open-ended age group: ex = 1 / nmx, with var(nmx) = nDx / nNx^2
+        variance_m = np.where(deaths[:, -1] > 0, deaths[:, -1] / population[:, -1] ** 2, 0.0)
+        last = lx[:, -1] ** 2 / nmx[:, -1] ** 4 * variance_m
+
+    terms = np.zeros_like(lx)
+    terms[:, :-1] = lx[:, :-1] ** 2 * ((1 - nax[:, :-1]) * n[:, :-1] + ex[:, 1:]) ** 2 * variance_q[:, :-1]
+    terms[:, -1] = last
+
+    # Every age group from x onwards contributes to the variance of ex
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.cumsum(terms[:, ::-1], axis=1)[:, ::-1] / lx ** 2
+
+
+def analytic_intervals(tables, level=0.95):
+    """
+    Return normal-approximation (lower, upper) bounds of ex from the Chiang variance.
+
+    level: Confidence level of the interval, e.g. 0.95.
+    """
+    z = NormalDist().inv_cdf(0.5 + level / 2)
+    half_width = z * np.sqrt(chiang_variance(tables))
+    return tables['ex'] - half_width, tables['ex'] + half_width
+
+
+def _replicate_batches(deaths, replicates, generator):
+    """Yield Poisson-resampled (replicates in batch, populations, age groups) death arrays"""
+    per_batch = max(1, MAX_BATCH_ROWS // max(len(deaths), 1))
+    mean = np.nan_to_num(np.clip(deaths, 0, None))
+    for start in range(0, replicates, per_batch):
+        count = min(per_batch, replicates - start)
+        yield generator.poisson(mean, size=(count,) + deaths.shape).astype(float)
+
+
+def resample_life_tables(deaths, population, column='ex', replicates=REPLICATES, seed=None, schema=DEFAULT_SCHEMA):
+    """
+    Calculate Poisson-resampled replicates of one life-table column.
+
+    deaths, population: Arrays of shape (populations, age groups).
+    column: Life-table column to keep from each replicate.
+    seed: Seed of the random generator, for reproducible intervals.
+
+    Returns:
+    An array of shape (replicates, populations, age groups).
+    """
+    deaths = np.atleast_2d(np.asarray(deaths, dtype=float))
+    population = np.atleast_2d(np.asarray(population, dtype=float))
+    generator = np.random.default_rng(seed)
+
+    results = []
+    for batch in _replicate_batches(deaths, replicates, generator):
+        # Every replicate of every population is one row of a single engine call
+        tables = calculate_life_tables(batch.reshape(-1, deaths.shape[1]),
+                                       np.broadcast_to(population, batch.shape).reshape(-1, deaths.shape[1]), schema)
+        results.append(tables[column].reshape(batch.shape))
+    return np.concatenate(results)
+
+
+def percentile_interval(replicates, level=0.95):
+    """Return the (lower, upper) percentile bounds over the first axis of replicates"""
+    lower, upper = np.nanpercentile(replicates, [50 * (1 - level), 50 * (1 + level)], axis=0)
+    return lower, upper
+
+
+@timed('uncertainty.monte_carlo')
+def monte_carlo_intervals(deaths, population, replicates=REPLICATES, level=0.95, seed=None, schema=DEFAULT_SCHEMA):
+    """
+    Return Monte Carlo (lower, upper) bounds of ex.
+
+    deaths, population: Arrays of shape (populations, age groups).
+
+    Returns:
+    Two arrays of shape (populations, age groups).
+    """
+    return percentile_interval(resample_life_tables(deaths, population, 'ex', replicates, seed, schema), level)
+
+
+@timed('uncertainty.contributions')
+def contribution_intervals(deaths_1, population_1, deaths_2, population_2, replicates=REPLICATES, level=0.95, seed=None,
+                           schema=DEFAULT_SCHEMA):
+    """
+    Return Monte Carlo bounds of the Arriaga contributions between pairs of life tables.
+
+    deaths_1, population_1: Arrays of shape (pairs, age groups) for the first member of each pair.
+    deaths_2, population_2: Arrays of the same shape for the second member.
+
+    Both members are resampled independently in every replicate.
+
+    Returns:
+    (lower, upper) arrays of shape (pairs, age groups) for the contributions, and
+    (lower, upper) arrays of shape (pairs,) for the life expectancy difference.
+    """
+    deaths_1 = np.atleast_2d(np.asarray(deaths_1, dtype=float))
+    deaths_2 = np.atleast_2d(np.asarray(deaths_2, dtype=float))
+    population_1 = np.atleast_2d(np.asarray(population_1, dtype=float))
+    population_2 = np.atleast_2d(np.asarray(population_2, dtype=float))
+    generator = np.random.default_rng(seed)
+    ages = deaths_1.shape[1]
+
+    # Resample both years together so one engine call covers every replicate pair
+    deaths = np.concatenate([deaths_1, deaths_2])
+    population = np.concatenate([population_1, population_2])
+    pairs = len(deaths_1)
+
+    results = []
+    for batch in _replicate_batches(deaths, replicates, generator):
+        tables = calculate_life_tables(batch.reshape(-1, ages), np.broadcast_to(population, batch.shape).reshape(-1, ages), schema)
+        tables = {column: values.reshape(batch.shape) for column, values in tables.items()}
+        results.append(arriaga_contributions(
+            {column: values[:, :pairs].reshape(-1, ages) for column, values in tables.items()},
+            {column: values[:, pairs:].reshape(-1, ages) for column, values in tables.items()},
+        ).reshape(len(batch), pairs, ages))
+    contributions = np.concatenate(results)
+
+    return percentile_interval(contributions, level), percentile_interval(contributions.sum(axis=2), level)
+
+
+def life_expectancy_interval_frame(tables, lower, upper, row=0, schema=DEFAULT_SCHEMA):
+    """Build a DataFrame of ex and its bounds for one life table"""
+    return pd.DataFrame({
+        'Age': schema.labels,
+        COLUMN_LABELS['ex']: tables['ex'][row],
+        'Lower bound': lower[row],
+        'Upper bound': upper[row],
+    })
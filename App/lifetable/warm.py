@@ -0,0 +1,223 @@
+"""
+Background precomputation of life tables after startup and data refreshes.
+
+A CacheWarmer fills LIFE_TABLE_CACHE (and optionally CONTRIBUTION_CACHE with the
+consecutive-year decompositions) from the local copy of a table, so the first page
+interaction after a restart or a refresh reads precomputed results. Groups are warmed
+most-viewed location first and most recent year first, in batches spread over a
+bounded thread pool, and no more groups than the cache holds are warmed. After a sync
+only the groups it reports as changed are rebuilt.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from lifetable import store
+from lifetable.cache import CONTRIBUTION_CACHE, LIFE_TABLE_CACHE, cached_life_tables
+from lifetable.data import LIFE_TABLE_COLUMNS
+from lifetable.decomposition import cached_contributions, consecutive_year_pairs
+from lifetable.index import GroupIndex
+from lifetable.metrics import incr, timed
+
+ENABLED = os.getenv('LIFETABLE_WARM', '1').lower() in ('1', 'true', 'yes', 'on')
+WORKERS = int(os.getenv('LIFETABLE_WARM_WORKERS', 2))
+DECOMPOSITIONS = os.getenv('LIFETABLE_WARM_DECOMPOSITIONS', '').lower() in ('1', 'true', 'yes', 'on')
+BATCH_SIZE = 256  # groups per task
+
+# How often each location was queried, kept next to the local copy so it survives restarts
+VIEWS_FILE = os.path.join(store.CACHE_DIR, '_views.json')
+
+_views = None
+_views_changed = False
+_views_lock = threading.Lock()
+_warmers = {}
+_warmers_lock = threading.Lock()
+
+
+def view_counts():
+    """Return a Counter of how often each location has been queried"""
+    global _views
+    with _views_lock:
+        if _views is None:
+            try:
+                with open(VIEWS_FILE) as file:
+                    _views = Counter(json.load(file))
+            except (OSError, ValueError):
+                _views = Counter()
+        return Counter(_views)
+
+
+def record_views(locations):
+    """Count one view of each location, kept in memory until save_views writes them out"""
+    global _views_changed
+    locations = [locations] if isinstance(locations, str) else list(locations)
+    if not locations:
+        return
+    view_counts()
+    with _views_lock:
+        _views.update(str(location) for location in locations)
+        _views_changed = True
+
+
+def save_views():
+    """Write the view counts to VIEWS_FILE if they changed since the last save"""
+    global _views_changed
+    with _views_lock:
+        if not _views_changed:
+            return
+        try:
+            os.makedirs(os.path.dirname(VIEWS_FILE), exist_ok=True)
+            temporary = f'{VIEWS_FILE}.{os.getpid()}.tmp'
+            with open(temporary, 'w') as file:
+                json.dump(_views, file)
+            os.replace(temporary, VIEWS_FILE)
+            _views_changed = False
+        except OSError:
+            # The counts only steer the warming order; losing them is harmless
+            pass
+
+
+atexit.register(save_views)
+
+
+def priority_order(groups, views=None):
+    """Order (location, sex, year) groups most-viewed location first, then most recent year first"""
+    views = view_counts() if views is None else views
+    return sorted(groups, key=lambda group: (-views.get(str(group[0]), 0), -group[2], str(group[0]), str(group[1])))
+
+
+class CacheWarmer:
+    """
+    Precompute the life tables of one table in a background thread.
+
+    table: Table of the local store holding the population data.
+    workers: Threads calculating batches of groups at the same time.
+    decompositions: Also precompute the consecutive-year Arriaga contributions.
+
+    The progress of the current run is in state ('idle', 'running', 'done' or
+    'failed'), done and total.
+    """
+
+    def __init__(self, table='PopulationData', workers=WORKERS, decompositions=DECOMPOSITIONS, batch_size=BATCH_SIZE):
+        self.table = table
+        self.workers = workers
+        self.decompositions = decompositions
+        self.batch_size = batch_size
+        self.state = 'idle'
+        self.done = 0
+        self.total = 0
+        self.error = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pending = False
+        self._groups = None
+
+    def request(self, groups=None):
+        """
+        Queue a warm of the given (location, sex, year) groups, or of every group when None.
+
+        Requests made while a run is in progress are merged and handled by one further run.
+        """
+        with self._lock:
+            if groups is None or (self._pending and self._groups is None):
+                self._groups = None
+            else:
+                self._groups = (self._groups if self._pending else set()) | {tuple(group) for group in groups}
+            self._pending = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name=f'warm-{self.table}', daemon=True)
+                self._thread.start()
+
+    def wait(self, timeout=None):
+        """Block until the queued runs have finished, e.g. in scripts; returns False on timeout"""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return self._thread is None
+
+    def progress(self):
+        """Return the state of the current or last run with its done and total counts"""
+        return {'state': self.state, 'done': self.done, 'total': self.total, 'error': self.error, 'finished_at': self.finished_at}
+
+    def _work(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._thread = None
+                    return
+                groups, self._groups, self._pending = self._groups, None, False
+            try:
+                self.error = None
+                self.warm(groups)
+            except Exception as error:
+                self.state, self.error = 'failed', error
+            self.finished_at = time.time()
+            # Views counted since the last run are written out here, off the pages' threads
+            save_views()
+
+    @timed('warm.run')
+    def warm(self, groups=None):
+        """Calculate and cache the life tables of the given groups, or of every group when None"""
+        # Without a fresh local copy warming would only move the load onto Supabase
+        if not store.is_fresh(self.table):
+            self.state, self.done, self.total = 'idle', 0, 0
+            return
+
+        filters = None if groups is None else {'location_name': sorted({group[0] for group in groups})}
+        if filters is not None and not filters['location_name']:
+            return
+        index = GroupIndex(store.read_table(self.table, LIFE_TABLE_COLUMNS, filters))
+        keys = index.keys if groups is None else [key for key in index.keys if key in groups]
+
+        # Warming more groups than the cache holds would evict the most wanted ones
+        keys = priority_order(keys)[:LIFE_TABLE_CACHE.maxsize]
+        pairs = []
+        if self.decompositions:
+            wanted = set(keys)
+            rank = {key: position for position, key in enumerate(keys)}
+            pairs = [pair for pair in consecutive_year_pairs(index.keys)
+                     if pair[:3] in wanted or (pair[0], pair[1], pair[3]) in wanted]
+            pairs.sort(key=lambda pair: rank.get((pair[0], pair[1], pair[3]), rank.get(pair[:3])))
+            pairs = pairs[:CONTRIBUTION_CACHE.maxsize]
+
+        self.state, self.done, self.total = 'running', 0, len(keys) + len(pairs)
+
+        def tables(batch):
+            cached_life_tables(batch, index.stack('total_deaths', batch), index.stack('population', batch), schema=index.schema)
+            return len(batch)
+
+        def contributions(batch):
+            cached_contributions(index, batch)
+            return len(batch)
+
+        batches = [(tables, keys[start:start + self.batch_size]) for start in range(0, len(keys), self.batch_size)]
+        batches += [(contributions, pairs[start:start + self.batch_size]) for start in range(0, len(pairs), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix=f'warm-{self.table}') as pool:
+            for future in as_completed([pool.submit(task, batch) for task, batch in batches]):
+                self.done += future.result()
+        self.state = 'done'
+        incr('warm.groups', len(keys))
+        incr('warm.pairs', len(pairs))
+
+
+def start_warming(table='PopulationData'):
+    """
+    Return the CacheWarmer of a table, creating it on first use in this process.
+
+    The first call queues a warm of every group and registers the warmer with the
+    store, so every later download, sync or append rewarms what it changed. Returns
+    None when warming is switched off with LIFETABLE_WARM=0.
+    """
+    if not ENABLED:
+        return None
+    with _warmers_lock:
+        warmer = _warmers.get(table)
+        if warmer is None:
+            warmer = _warmers[table] = CacheWarmer(table)
+            store.add_refresh_listener(table, warmer.request)
+            warmer.request()
+    return warmer
@@ -1,70 +1,59 @@
+import math
 import streamlit as st
-import os
-from dotenv import load_dotenv
-import pandas as pd
-from supabase import create_client, Client
+from lifetable.query import aggregate_table, count_matching, distinct_values, query_page
+from lifetable.ui import data_refresh_button, dataframe, metrics_panel, track_views
 
-load_dotenv()
-
-# Supabase credentials
-url = os.getenv("PROJECT_URL")
-key = os.getenv("SECRET_PROJECT_API_KEY")
-
-# Initialize Supabase client
-supabase: Client = create_client(url, key)
-
-
-def load_data():
-    """Fetch data from Supabase table 'LifeTables' with pagination"""
-    # Initialize an empty list to hold all data
-    data_list = []
-    
-    # Fetch data in chunks to avoid hitting any row limits
-    start_row = 0
-    batch_size = 1000  # Adjust the batch size if needed
-    
-    while True:
-        response = supabase.table('PopulationData').select("*").range(start_row, start_row + batch_size - 1).execute()
-        batch_data = response.data
-        
-        # If no more data is fetched, break the loop
-        if not batch_data:
-            break
-        
-        # Append fetched batch data to the list
-        data_list.extend(batch_data)
-        start_row += batch_size
-    
-    # Convert the list of data to a DataFrame
-    return pd.DataFrame(data_list)
-
-# Load data from Supabase
-df = load_data()
 st.set_page_config(layout="wide")
 st.title('Data Viewer')
 
+# Load data from the local copy of Supabase
+data_refresh_button('PopulationData')
 
-# Debugging: Display unique countries
-#st.sidebar.write(f"Unique countries in data: {df['location_name'].unique()}")
-
-# Create multi-select filters for year, age, gender, and country
-years = df['year'].unique()
-ages = df['age_name'].unique()
-genders = df['sex_name'].unique()
-countries = df['location_name'].unique()
-
-selected_years = st.sidebar.multiselect('Select Year(s)', years, default=years)
-selected_ages = st.sidebar.multiselect('Select Age Group(s)', ages, default=ages)
-selected_genders = st.sidebar.multiselect('Select Gender(s)', genders, default=genders)
-selected_countries = st.sidebar.multiselect('Select Country(ies)', countries, default=countries)
 
-# Filter data based on selections
-filtered_df = df[
-    (df['year'].isin(selected_years)) &
-    (df['age_name'].isin(selected_ages)) &
-    (df['sex_name'].isin(selected_genders)) &
-    (df['location_name'].isin(selected_countries))
-]
-
-# Display the filtered dataframe in wide format
-st.dataframe(filtered_df)
+# Debugging: Display unique countries
+#st.sidebar.write(f"Unique countries in data: {distinct_values('PopulationData', 'location_name')}")
+
+# Create multi-select filters for year, age, gender, and country; an empty selection shows everything
+with st.spinner('Loading choices...'):
+    years = distinct_values('PopulationData', 'year')
+    ages = distinct_values('PopulationData', 'age_name')
+    genders = distinct_values('PopulationData', 'sex_name')
+    countries = distinct_values('PopulationData', 'location_name')
+
+selected_years = st.sidebar.multiselect('Select Year(s)', years, placeholder='All years')
+selected_ages = st.sidebar.multiselect('Select Age Group(s)', ages, placeholder='All age groups')
+selected_genders = st.sidebar.multiselect('Select Gender(s)', genders, placeholder='All genders')
+selected_countries = st.sidebar.multiselect('Select Country(ies)', countries, placeholder='All countries')
+track_views(selected_countries)
+
+# Filters are applied where the data lives, only for the columns with a selection
+filters = {column: selection for column, selection in [
+    ('year', selected_years),
+    ('age_name', selected_ages),
+    ('sex_name', selected_genders),
+    ('location_name', selected_countries),
+] if selection}
+
+view = st.radio('View', ['Rows', 'Totals by country and year'], horizontal=True)
+
+if view == 'Rows':
+    # Only the visible window of rows is loaded and sent to the browser
+    with st.spinner('Counting rows...'):
+        total_rows = count_matching('PopulationData', filters)
+    page_size = st.sidebar.selectbox('Rows per page', [50, 100, 500, 1000], index=1)
+    pages = max(1, math.ceil(total_rows / page_size))
+    page = st.number_input('Page', min_value=1, max_value=pages, value=1, step=1)
+    offset = (page - 1) * page_size
+
+    with st.spinner('Loading rows...'):
+        page_df = query_page('PopulationData', filters=filters, offset=offset, limit=page_size)
+    st.caption(f"Rows {min(offset + 1, total_rows)}-{min(offset + page_size, total_rows)} of {total_rows} (page {page} of {pages})")
+    dataframe(page_df)
+else:
+    # Deaths and population summed over age groups and genders where the data lives
+    with st.spinner('Summing totals...'):
+        totals = aggregate_table('PopulationData', ['location_name', 'year'], ['total_deaths', 'population'], filters)
+    st.caption(f"{len(totals)} country-years")
+    dataframe(totals)
+
+metrics_panel()
@@ -0,0 +1,51 @@
+import streamlit as st
+from lifetable.ages import DEFAULT_SCHEMA
+from lifetable.data import LIFE_TABLE_COLUMNS
+from lifetable.index import GroupIndex
+from lifetable.query import distinct_values, query_table
+from lifetable.trends import life_expectancy_trends
+from lifetable.ui import data_refresh_button, dataframe, metrics_panel, track_views
+
+# New Streamlit page for life expectancy over time
+st.title('Life Expectancy Trends')
+
+data_refresh_button('PopulationData')
+
+# User selections for countries, genders and the ages to follow
+with st.spinner('Loading choices...'):
+    countries = distinct_values('PopulationData', 'location_name')
+    genders = distinct_values('PopulationData', 'sex_name')
+selected_countries = st.sidebar.multiselect('Select Countries', countries, default=countries[:1])
+track_views(selected_countries)
+selected_genders = st.sidebar.multiselect('Select Genders', genders, default=genders)
+selected_ages = st.sidebar.multiselect('Life Expectancy at Age', DEFAULT_SCHEMA.labels, default=DEFAULT_SCHEMA.labels[:1])
+
+if selected_countries and selected_genders:
+    # Load every year of the selected countries and genders, and calculate them all in one pass
+    with st.spinner('Calculating life expectancy for every year...'):
+        index = GroupIndex(query_table('PopulationData', LIFE_TABLE_COLUMNS, {
+            'location_name': selected_countries,
+            'sex_name': selected_genders,
+        }))
+        trends = life_expectancy_trends(index, selected_ages)
+
+    if trends.empty:
+        st.write("No data available for the selected filters.")
+    else:
+        # One line per country, gender and age
+        chart = trends.assign(series=trends['location_name'].astype(str) + ' ' + trends['sex_name'].astype(str)
+                              + ' ' + trends['age_name'].astype(str))
+        st.line_chart(chart, x='year', y='ex', color='series')
+        dataframe(trends)
+
+        csv = trends.to_csv(index=False).encode('utf-8')
+        st.download_button(
+            label="Download Trends as CSV",
+            data=csv,
+            file_name='life_expectancy_trends.csv',
+            mime='text/csv',
+        )
+else:
+    st.write("Please select at least one country and gender.")
+
+metrics_panel()
@@ -0,0 +1,62 @@
+import streamlit as st
+from lifetable.cause_deleted import cause_deleted_gains, deletion_scenarios
+from lifetable.data import LIFE_TABLE_COLUMNS, RISK_FACTOR_COLUMNS
+from lifetable.index import GroupIndex
+from lifetable.query import distinct_values, query_table
+from lifetable.ui import data_refresh_button, dataframe, metrics_panel, track_views
+
+# New Streamlit page for life expectancy without tobacco, alcohol or drug deaths
+st.title('Cause-Deleted Life Expectancy')
+st.write("Gain in life expectancy at birth if the deaths attributed to each risk factor, "
+         "alone or combined, had not happened.")
+
+data_refresh_button('PopulationData')
+
+# User selections; leaving countries or years empty means all of them
+with st.spinner('Loading choices...'):
+    years = distinct_values('PopulationData', 'year')
+    countries = distinct_values('PopulationData', 'location_name')
+    genders = distinct_values('PopulationData', 'sex_name')
+selected_countries = st.sidebar.multiselect('Select Countries (all when empty)', countries)
+track_views(selected_countries)
+selected_years = st.sidebar.multiselect('Select Years (all when empty)', years)
+selected_genders = st.sidebar.multiselect('Select Genders', genders, default=genders)
+scenarios = deletion_scenarios()
+selected_scenarios = st.sidebar.multiselect('Risk Factors Removed', list(scenarios), default=list(scenarios))
+
+if st.button('Calculate Cause-Deleted Life Expectancy'):
+    if selected_genders and selected_scenarios:
+        filters = {'sex_name': selected_genders}
+        if selected_countries:
+            filters['location_name'] = selected_countries
+        if selected_years:
+            filters['year'] = selected_years
+
+        # Every group and scenario is calculated in one pass
+        with st.spinner('Calculating cause-deleted life tables...'):
+            index = GroupIndex(query_table('PopulationData', LIFE_TABLE_COLUMNS + RISK_FACTOR_COLUMNS, filters))
+            gains = cause_deleted_gains(index, scenarios={name: scenarios[name] for name in selected_scenarios})
+
+        if gains.empty:
+            st.write("No data available for the selected filters.")
+        else:
+            st.write(f"Gain in e0 (years) for {len(index)} populations:")
+            summary = gains.pivot_table(index=['location_name', 'sex_name', 'year'], columns='scenario', values='gain',
+                                        observed=True)
+            summary.columns = summary.columns.astype(str)
+            dataframe(summary)
+
+            st.write("Average gain in e0 by risk factor:")
+            st.bar_chart(gains.groupby('scenario', observed=True)['gain'].mean())
+
+            csv = gains.to_csv(index=False).encode('utf-8')
+            st.download_button(
+                label="Download Cause-Deleted Gains as CSV",
+                data=csv,
+                file_name='cause_deleted_gains.csv',
+                mime='text/csv',
+            )
+    else:
+        st.warning("Please select at least one gender and one risk factor.")
+
+metrics_panel()
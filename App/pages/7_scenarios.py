@@ -0,0 +1,88 @@
+import pandas as pd
+import streamlit as st
+from lifetable.ages import DEFAULT_SCHEMA
+from lifetable.cache import cached_life_tables
+from lifetable.data import LIFE_TABLE_COLUMNS
+from lifetable.index import GroupIndex
+from lifetable.query import distinct_values, query_table
+from lifetable.scenarios import RateChange, scenario_gains, scenario_life_tables
+from lifetable.ui import data_refresh_button, dataframe, metrics_panel, track_views
+
+# New Streamlit page for what-if changes in mortality
+st.title('Mortality Scenarios')
+st.write("Change death rates over a range of ages and see the effect on life expectancy straight away.")
+
+data_refresh_button('PopulationData')
+
+# User selections for the populations the scenario applies to
+with st.spinner('Loading choices...'):
+    years = distinct_values('PopulationData', 'year')
+    countries = distinct_values('PopulationData', 'location_name')
+    genders = distinct_values('PopulationData', 'sex_name')
+selected_countries = st.sidebar.multiselect('Select Countries', countries, default=countries[:1])
+track_views(selected_countries)
+selected_genders = st.sidebar.multiselect('Select Genders', genders, default=genders)
+selected_year = st.sidebar.selectbox('Select Year', years, index=len(years) - 1 if years else 0)
+
+# One set of controls per change; every move of a slider reruns the update below
+labels = DEFAULT_SCHEMA.labels
+change_count = st.number_input('Number of changes', min_value=1, max_value=3, value=1)
+changes = []
+for number in range(int(change_count)):
+    columns = st.columns([3, 2, 3])
+    first, last = columns[0].select_slider('Ages', labels, value=(labels[min(10, len(labels) - 1)], labels[min(13, len(labels) - 1)]),
+                                           key=f'ages_{number}')
+    kind = columns[1].radio('Change', ['Relative', 'Absolute'], key=f'kind_{number}')
+    if kind == 'Relative':
+        percent = columns[2].slider('Change in death rates (%)', -100, 100, -20, key=f'percent_{number}')
+        changes.append(RateChange(first, last, factor=1 + percent / 100))
+    else:
+        per_100k = columns[2].slider('Deaths per 100,000 added', -1000, 1000, -100, step=10, key=f'shift_{number}')
+        changes.append(RateChange(first, last, shift=per_100k / 100000))
+
+if selected_countries and selected_genders and years:
+    with st.spinner('Loading data...'):
+        index = GroupIndex(query_table('PopulationData', LIFE_TABLE_COLUMNS, {
+            'year': selected_year,
+            'location_name': selected_countries,
+            'sex_name': selected_genders,
+        }))
+
+    if not index.keys:
+        st.write("No data available for the selected filters.")
+    else:
+        # The observed tables come from the shared cache; only the scenario is recalculated
+        tables = cached_life_tables(index.keys, index.stack('total_deaths'), index.stack('population'))
+        scenario = scenario_life_tables(tables, changes)
+        reported_ages = list(dict.fromkeys([labels[0]] + [change.first for change in changes]))
+        gains = scenario_gains(index.keys, tables, scenario, reported_ages)
+
+        st.write("Life expectancy before and after the changes (years):")
+        dataframe(gains)
+
+        st.write("Gain in life expectancy at birth:")
+        e0 = gains[gains['age_name'] == labels[0]]
+        st.bar_chart(pd.Series(e0['gain'].to_numpy(), index=e0['location_name'].astype(str) + ' ' + e0['sex_name'].astype(str)))
+
+        # Life expectancy at every age for the first population
+        location, sex, year = index.keys[0]
+        st.write(f"Life expectancy by age for {location} ({sex}) in {year}:")
+        dataframe(pd.DataFrame({
+            'Age': labels,
+            'Observed ex': tables['ex'][0],
+            'Scenario ex': scenario['ex'][0],
+            'Observed nmx': tables['nmx'][0],
+            'Scenario nmx': scenario['nmx'][0],
+        }))
+
+        csv = gains.to_csv(index=False).encode('utf-8')
+        st.download_button(
+            label="Download Scenario Results as CSV",
+            data=csv,
+            file_name=f'scenario_{selected_year}.csv',
+            mime='text/csv',
+        )
+else:
+    st.write("Please select at least one country and gender.")
+
+metrics_panel()
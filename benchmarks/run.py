@@ -0,0 +1,207 @@
+"""
+Benchmarks for the life-table, decomposition and loading hot paths.
+
+Usage (from the repository root):
+    python benchmarks/run.py [--scales 1 1000 100000] [--repeat 5] [--latency 0.05] [--output results.json]
+
+Every benchmark runs on synthetic 22-age-group data, fully offline. Results are
+written as JSON so runs can be compared between versions.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'App'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+from lifetable import data
+from lifetable.cache import CONTRIBUTION_CACHE, LIFE_TABLE_CACHE
+from lifetable.cause_deleted import cause_deleted_gains
+from lifetable.decomposition import (calculate_life_expectancy_contribution, calculate_risk_factor_proportions,
+                                     decompose_pairs)
+from lifetable.engine import calculate_life_table, calculate_life_tables
+from lifetable.index import GroupIndex
+from lifetable.scenarios import RateChange, apply_changes, update_life_tables
+from lifetable.sources import LOCAL_BACKENDS, open_source
+from lifetable.uncertainty import analytic_intervals, monte_carlo_intervals
+from synthetic import FakePagedClient, make_population_data
+
+# Largest scale at which the per-table DataFrame functions are still run
+PER_TABLE_LIMIT = 1000
+
+
+def measure(function, repeat, setup=None):
+    """Return the wall-clock seconds of each of `repeat` calls of function, running setup untimed before each"""
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def result(name, scale, timings, **extra):
+    """One machine-readable benchmark record"""
+    return {
+        'name': name,
+        'scale': scale,
+        'repeat': len(timings),
+        'min_s': min(timings),
+        'median_s': statistics.median(timings),
+        'per_table_s': min(timings) / scale if scale else None,
+        **extra,
+    }
+
+
+def bench_life_tables(index, scale, repeat):
+    deaths, population = index.stack('total_deaths'), index.stack('population')
+    results = [result('calculate_life_tables', scale, measure(lambda: calculate_life_tables(deaths, population), repeat))]
+    if scale <= PER_TABLE_LIMIT:
+        rows = [(deaths[row].tolist(), population[row].tolist()) for row in range(scale)]
+        timings = measure(lambda: [calculate_life_table(d, p) for d, p in rows], repeat)
+        results.append(result('calculate_life_table', scale, timings))
+    return results
+
+
+def clear_caches():
+    """Empty the process-wide result caches so every repeat measures the calculation, not cache lookups"""
+    LIFE_TABLE_CACHE.invalidate()
+    CONTRIBUTION_CACHE.invalidate()
+
+
+def bench_decomposition(index, scale, repeat):
+    # Pair every table with the next one of the same location and sex
+    pairs = [(location, sex, year, year + 1) for location, sex, year in index.keys if (location, sex, year + 1) in index]
+    pairs = (pairs * (scale // max(len(pairs), 1) + 1))[:scale] if pairs else []
+    results = [result('decompose_pairs', len(pairs), measure(lambda: decompose_pairs(index, pairs), repeat, clear_caches))]
+    if pairs and scale <= PER_TABLE_LIMIT:
+        tables = [(calculate_life_table(index.rows(*key_1)['total_deaths'].tolist(), index.rows(*key_1)['population'].tolist()),
+                   calculate_life_table(index.rows(*key_2)['total_deaths'].tolist(), index.rows(*key_2)['population'].tolist()))
+                  for key_1, key_2 in (((l, s, y1), (l, s, y2)) for l, s, y1, y2 in pairs)]
+        timings = measure(lambda: [calculate_life_expectancy_contribution(t1, t2) for t1, t2 in tables], repeat)
+        results.append(result('calculate_life_expectancy_contribution', len(pairs), timings))
+    return results
+
+
+def bench_risk_factor_proportions(index, scale, repeat):
+    if scale > PER_TABLE_LIMIT:
+        return []
+    groups = [index.rows(*key) for key in index.keys]
+    timings = measure(lambda: [calculate_risk_factor_proportions(group, group['year'].iloc[0]) for group in groups], repeat)
+    return [result('calculate_risk_factor_proportions', scale, timings)]
+
+
+def bench_intervals(index, scale, repeat):
+    if scale > PER_TABLE_LIMIT:
+        return []
+    deaths, population = index.stack('total_deaths'), index.stack('population')
+    tables = calculate_life_tables(deaths, population)
+    results = [result('analytic_intervals', scale, measure(lambda: analytic_intervals(tables), repeat))]
+    timings = measure(lambda: monte_carlo_intervals(deaths, population, replicates=1000, seed=0), repeat)
+    results.append(result('monte_carlo_intervals', scale, timings, replicates=1000))
+    return results
+
+
+def bench_cause_deleted(index, scale, repeat):
+    timings = measure(lambda: cause_deleted_gains(index), repeat)
+    return [result('cause_deleted_gains', scale, timings, scenarios=7)]
+
+
+def bench_scenarios(index, scale, repeat):
+    deaths, population = index.stack('total_deaths'), index.stack('population')
+    tables = calculate_life_tables(deaths, population)
+    nmx, changed = apply_changes(tables['nmx'], [RateChange('40-44 years', '55-59 years', factor=0.8)])
+    results = [result('update_life_tables', scale, measure(lambda: update_life_tables(tables, nmx, changed), repeat))]
+    timings = measure(lambda: calculate_life_tables(nmx * population, population), repeat)
+    results.append(result('scenario_full_recalculation', scale, timings))
+    return results
+
+
+def bench_load(frame, scale, repeat, latency):
+    client = FakePagedClient(frame, latency=latency)
+    data._client = client
+    try:
+        timings = measure(lambda: data.fetch_table('PopulationData'), repeat)
+        requests = client.requests // repeat
+        results = [result('fetch_table', scale, timings, rows=len(frame), requests=requests, latency_s=latency)]
+        timings = measure(lambda: data.fetch_table('PopulationData', columns=data.LIFE_TABLE_COLUMNS, max_workers=1), repeat)
+        results.append(result('fetch_table_serial', scale, timings, rows=len(frame), latency_s=latency))
+    finally:
+        data._client = None
+    return results
+
+
+def bench_backends(frame, scale, repeat):
+    # A filtered, column-projected query like the pages run, against each local backend
+    location = frame['location_name'].iloc[0]
+    filters = {'location_name': location, 'year': sorted(frame['year'].unique().tolist())[:2]}
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        for backend in LOCAL_BACKENDS:
+            source = open_source(backend, cache_dir=directory)
+            try:
+                source.write('PopulationData', frame)
+            except ImportError:
+                continue  # optional backend not installed
+            timings = measure(lambda: source.query('PopulationData', data.LIFE_TABLE_COLUMNS, filters), repeat)
+            results.append(result(f'query_{backend}', scale, timings, rows=len(frame)))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 1000, 100000], help="Numbers of life tables to benchmark")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per benchmark; min and median are reported")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds per fake Supabase request")
+    parser.add_argument('--load-limit', type=int, default=1000, help="Largest scale for the paginated load benchmark")
+    parser.add_argument('--output', help="Write the JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = []
+    for scale in args.scales:
+        frame = make_population_data(scale)
+        started = time.perf_counter()
+        index = GroupIndex(frame)
+        results.append(result('GroupIndex', scale, [time.perf_counter() - started]))
+        results += bench_life_tables(index, scale, args.repeat)
+        results += bench_decomposition(index, scale, args.repeat)
+        results += bench_risk_factor_proportions(index, scale, args.repeat)
+        results += bench_intervals(index, scale, args.repeat)
+        results += bench_cause_deleted(index, scale, args.repeat)
+        results += bench_scenarios(index, scale, args.repeat)
+        if scale <= args.load_limit:
+            results += bench_load(frame, scale, args.repeat, args.latency)
+        results += bench_backends(frame, scale, args.repeat)
+        print(f"scale {scale}: done", file=sys.stderr)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Synthetic PopulationData and a fake paged Supabase client for the benchmarks."""
+import time
+import numpy as np
+import pandas as pd
+from lifetable.ages import DEFAULT_SCHEMA
+
+SEXES = ['Male', 'Female']
+
+
+def make_population_data(tables, seed=0):
+    """
+    Return a PopulationData-like frame holding `tables` complete populations on the default age schema.
+
+    Groups are spread over locations, both sexes and years from 1991; mortality rises
+    roughly exponentially with age and risk-factor deaths are random shares of the total.
+    """
+    rng = np.random.default_rng(seed)
+    years_per_location = 31
+    groups = [(f'Location {number // (2 * years_per_location)}', SEXES[number // years_per_location % 2], 1991 + number % years_per_location)
+              for number in range(tables)]
+
+    ages = len(DEFAULT_SCHEMA)
+    population = rng.uniform(1e3, 1e6, size=(tables, ages))
+    rates = np.exp(np.linspace(-6.5, -0.7, ages)) * rng.uniform(0.7, 1.3, size=(tables, ages))
+    deaths = population * rates
+
+    location, sex, year = zip(*groups) if groups else ((), (), ())
+    return pd.DataFrame({
+        'id': np.arange(1, tables * ages + 1),
+        'location_name': np.repeat(location, ages),
+        'sex_name': np.repeat(sex, ages),
+        'year': np.repeat(np.array(year, dtype=np.int64), ages),
+        'age_name': np.tile(DEFAULT_SCHEMA.labels, tables),
+        'population': population.ravel(),
+        'total_deaths': deaths.ravel(),
+        'tobacco_deaths': (deaths * rng.uniform(0, 0.2, size=deaths.shape)).ravel(),
+        'alc_deaths': (deaths * rng.uniform(0, 0.1, size=deaths.shape)).ravel(),
+        'drug_deaths': (deaths * rng.uniform(0, 0.05, size=deaths.shape)).ravel(),
+    })
+
+
+class _Response:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class _Query:
+    """Just enough of the postgrest query builder for lifetable.data"""
+
+    def __init__(self, frame, latency):
+        self.frame = frame
+        self.latency = latency
+        self.columns = None
+        self.head = False
+        self.count = None
+        self.bounds = None
+        self.mask = np.ones(len(frame), dtype=bool)
+        self.order_by = None
+
+    def select(self, columns='*', count=None, head=None):
+        self.columns = None if columns == '*' else columns.split(',')
+        self.count = count
+        self.head = head
+        return self
+
+    def eq(self, column, value):
+        self.mask &= (self.frame[column] == value).to_numpy()
+        return self
+
+    def in_(self, column, values):
+        self.mask &= self.frame[column].isin(list(values)).to_numpy()
+        return self
+
+    def gt(self, column, value):
+        self.mask &= (self.frame[column] > value).to_numpy()
+        return self
+
+    def order(self, column, desc=False):
+        self.order_by = (column, desc)
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end)
+        return self
+
+    def execute(self):
+        time.sleep(self.latency)
+        rows = self.frame[self.mask]
+        if self.head:
+            return _Response([], len(rows))
+        if self.order_by is not None:
+            rows = rows.sort_values(self.order_by[0], ascending=not self.order_by[1], kind='stable')
+        if self.bounds is not None:
+            rows = rows.iloc[self.bounds[0]:self.bounds[1] + 1]
+        if self.columns is not None:
+            rows = rows[self.columns]
+        return _Response(rows.to_dict('records'), len(rows) if self.count else None)
+
+
+class FakePagedClient:
+    """
+    Stand-in for the Supabase client serving one frame for every table.
+
+    Each request sleeps for `latency` seconds to mimic a round trip and range
+    requests return at most the requested rows, like PostgREST.
+    """
+
+    def __init__(self, frame, latency=0.05):
+        self.frame = frame
+        self.latency = latency
+        self.requests = 0
+
+    def table(self, name):
+        self.requests += 1
+        return _Query(self.frame, self.latency)